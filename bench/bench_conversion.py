@@ -0,0 +1,77 @@
+"""
+bench/bench_conversion.py
+─────────────────────────
+Páginas/segundo del motor de conversión (ProcessPoolExecutor) frente al
+ThreadPoolExecutor(8) anterior, sobre un ZIP sintético.
+
+    python -m bench.bench_conversion                 # 64 páginas 1800×2700
+    python -m bench.bench_conversion --paginas 200 --ancho 2400 --alto 3600
+
+Se ejecuta desde la raíz del proyecto.  Solo necesita Pillow.
+"""
+from __future__ import annotations
+import argparse, io, os, shutil, tempfile, time, zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+import services.conversion_service as conversion_service
+
+
+def _zip_sintetico(ruta: str, paginas: int, ancho: int, alto: int) -> list[str]:
+    """ZIP con páginas PNG de ruido (el peor caso para el codificador JPEG)."""
+    nombres = []
+    with zipfile.ZipFile(ruta, "w", zipfile.ZIP_STORED) as zf:
+        base = Image.effect_noise((ancho, alto), 64).convert("RGB")
+        for i in range(paginas):
+            buf = io.BytesIO()
+            base.rotate(i % 4 * 90, expand=False).save(buf, "PNG", compress_level=1)
+            nombre = f"c001/{i + 1:03d}.png"
+            zf.writestr(nombre, buf.getvalue())
+            nombres.append(nombre)
+    return nombres
+
+
+def _medir(nombre: str, convertir, zip_path: str, inner: list[str], salida: str, hilos: int) -> float:
+    shutil.rmtree(salida, ignore_errors=True)
+    os.makedirs(salida)
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=hilos) as ex:
+        list(ex.map(
+            lambda p: convertir(zip_path, p, os.path.join(salida, os.path.basename(p) + ".jpg")),
+            inner,
+        ))
+    seg = time.perf_counter() - t0
+    print(f"{nombre:<28} {len(inner) / seg:8.1f} páginas/s  ({seg:.2f} s)")
+    return seg
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--paginas", type=int, default=64)
+    ap.add_argument("--ancho",   type=int, default=1800)
+    ap.add_argument("--alto",    type=int, default=2700)
+    ap.add_argument("--hilos",   type=int, default=8, help="hilos del executor actual")
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="bench_conv_")
+    try:
+        zip_path = os.path.join(tmp, "vol.zip")
+        inner    = _zip_sintetico(zip_path, args.paginas, args.ancho, args.alto)
+        print(f"{args.paginas} páginas {args.ancho}×{args.alto}, CPUs={os.cpu_count()}, "
+              f"procesos={conversion_service.PROCESOS}\n")
+
+        # Arranca los procesos antes de medir (spawn + import de PIL)
+        conversion_service._ejecutar(zip_path, inner[0], os.path.join(tmp, "warm.jpg"))
+
+        hilos    = _medir(f"ThreadPoolExecutor({args.hilos})", conversion_service._codificar,
+                          zip_path, inner, os.path.join(tmp, "hilos"), args.hilos)
+        procesos = _medir(f"ProcessPool({conversion_service.PROCESOS})", conversion_service._ejecutar,
+                          zip_path, inner, os.path.join(tmp, "procesos"), args.hilos)
+        print(f"\nAceleración: ×{hilos / procesos:.2f}")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
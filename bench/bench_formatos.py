@@ -0,0 +1,82 @@
+"""
+bench/bench_formatos.py
+───────────────────────
+Bytes y tiempo de codificación por formato (JPEG / WebP / AVIF) sobre un
+capítulo de muestra, con los mismos parámetros que conversion_service.
+
+    python -m bench.bench_formatos --zip static/uploads/zips/vol.zip --paginas 30
+    python -m bench.bench_formatos                   # páginas sintéticas
+    python -m bench.bench_formatos --ancho 1080      # rendición de 1080 px
+
+Se ejecuta desde la raíz del proyecto.  Solo necesita Pillow.
+"""
+from __future__ import annotations
+import argparse, io, os, random, shutil, tempfile, time, zipfile
+
+from PIL import Image, ImageDraw
+
+import services.conversion_service as conversion_service
+
+IMG_EXT = (".png", ".jpg", ".jpeg", ".webp")
+
+
+def _zip_sintetico(ruta: str, paginas: int) -> None:
+    """Páginas tipo manga: fondo blanco, viñetas, trazos y trama en gris."""
+    rnd = random.Random(7)
+    with zipfile.ZipFile(ruta, "w", zipfile.ZIP_STORED) as zf:
+        for i in range(paginas):
+            img = Image.new("L", (1600, 2400), 255)
+            d = ImageDraw.Draw(img)
+            for _ in range(6):
+                x, y = rnd.randrange(0, 1200), rnd.randrange(0, 2000)
+                d.rectangle((x, y, x + rnd.randrange(200, 400), y + rnd.randrange(200, 400)),
+                            outline=0, width=6, fill=rnd.choice((255, 200, 160)))
+            for _ in range(300):
+                d.line([(rnd.randrange(1600), rnd.randrange(2400)) for _ in range(2)],
+                       fill=rnd.randrange(0, 80), width=rnd.randrange(1, 5))
+            buf = io.BytesIO()
+            img.save(buf, "PNG")
+            zf.writestr(f"c001/{i + 1:03d}.png", buf.getvalue())
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--zip", help="ZIP real (si no, se generan páginas sintéticas)")
+    ap.add_argument("--paginas", type=int, default=20, help="páginas a codificar")
+    ap.add_argument("--ancho", type=int, default=None, help="ancho de rendición (px)")
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="bench_fmt_")
+    try:
+        zip_path = args.zip
+        if not zip_path:
+            zip_path = os.path.join(tmp, "muestra.zip")
+            _zip_sintetico(zip_path, args.paginas)
+        with zipfile.ZipFile(zip_path) as zf:
+            inner = sorted(n for n in zf.namelist()
+                           if n.lower().endswith(IMG_EXT) and not n.startswith("__MACOSX/"))
+        inner = inner[:args.paginas]
+
+        formatos = conversion_service.formatos_disponibles()
+        print(f"{len(inner)} páginas de {os.path.basename(zip_path)}, ancho={args.ancho or 'original'}")
+        print(f"Formatos disponibles: {', '.join(formatos)}\n")
+        print(f"{'formato':<8} {'KB/página':>10} {'ms/página':>10} {'vs JPEG':>8}")
+
+        base = None
+        for formato in formatos:
+            ext = conversion_service.FORMATOS[formato][0]
+            total, t0 = 0, time.perf_counter()
+            for i, p in enumerate(inner):
+                dst = os.path.join(tmp, f"{i}{ext}")
+                conversion_service._codificar(zip_path, p, dst, args.ancho, formato)
+                total += os.path.getsize(dst)
+            ms = 1_000 * (time.perf_counter() - t0) / len(inner)
+            kb = total / len(inner) / 1024
+            base = base or kb
+            print(f"{formato:<8} {kb:>10.1f} {ms:>10.1f} {kb / base:>7.0%}")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
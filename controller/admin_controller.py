@@ -1,7 +1,8 @@
 from flask import jsonify, request, current_app
-from flask_jwt_extended import get_jwt_identity
 from pymysql.cursors import DictCursor
 import db.database as db
+import controller.auth_controller as auth_controller
+import services.identidad_service as identidad_service
 
 import services.admin_service as admin_service
 
@@ -45,15 +46,13 @@ def aprobar_proveedor():
         return jsonify({"success": False, "message": "Falta el campo id_user"}), 400
 
     try:
-        with db.obtener_conexion() as cn, cn.cursor(DictCursor) as cur:
-            # 2) Obtengo el id del admin desde el JWT
-            email_admin = get_jwt_identity()
-            cur.execute("SELECT id_user FROM usuario WHERE email = %s", (email_admin,))
-            fila = cur.fetchone()
-            if not fila:
-                return jsonify({"success": False, "message": "Admin no encontrado"}), 404
-            id_admin = fila["id_user"] if isinstance(fila, dict) else fila[0]
+        # 2) Obtengo el id del admin desde el JWT
+        principal = auth_controller.obtener_principal()
+        if principal is None:
+            return jsonify({"success": False, "message": "Admin no encontrado"}), 404
+        id_admin = principal.id_user
 
+        with db.obtener_conexion() as cn, cn.cursor(DictCursor) as cur:
             # 3) Actualizo el usuario objetivo marcándolo como proveedor y registro auditoría
             cur.execute("""
                 UPDATE usuario
@@ -68,6 +67,8 @@ def aprobar_proveedor():
             if cur.rowcount == 0:
                 return jsonify({"success": False, "message": "Usuario no encontrado"}), 404
 
+        identidad_service.invalidar(id_user=id_objetivo)
+
         # 4) Éxito
         return jsonify({"success": True, "message": "Proveedor aprobado correctamente"}), 200
 
@@ -1,8 +1,84 @@
 import bcrypt
-from flask import jsonify, request
-from flask_jwt_extended import create_access_token, get_jwt_identity
+from functools import wraps
+from flask import jsonify, request, g
+from flask_jwt_extended import create_access_token, get_jwt, get_jwt_identity
 import services.usuario_service as usuario_service
+import services.identidad_service as identidad_service
 from models.Usuario import Usuario
+from models.Principal import Principal, ROL_LECTOR, ROL_PROVEEDOR, ROL_ADMIN
+
+ROLES = {"lector": ROL_LECTOR, "proveedor": ROL_PROVEEDOR, "admin": ROL_ADMIN}
+
+
+def crear_token(email, id_user, id_rol=None, id_lec=None, **kwargs):
+    """Access token con id_user / id_rol / id_lec como claims adicionales."""
+    principal = Principal(email, id_user, id_rol, id_lec)
+    return create_access_token(identity=email, additional_claims=principal.claims(), **kwargs)
+
+
+def obtener_principal():
+    """
+    Principal de la petición actual (requiere @jwt_required previo).
+    Los tokens nuevos traen los ids en los claims y no tocan la BD; los
+    emitidos antes del cambio se resuelven por email con la caché de identidades.
+    """
+    if "principal" in g:
+        return g.principal
+    email  = get_jwt_identity()
+    claims = get_jwt()
+    if claims.get("id_user") is not None:
+        principal = Principal(email, claims["id_user"], claims.get("id_rol"), claims.get("id_lec"))
+    else:
+        fila = identidad_service.obtener(email)
+        principal = Principal(email, fila["id_user"], fila["id_rol"], fila["id_lec"]) if fila else None
+    g.principal = principal
+    return principal
+
+
+def con_principal(fn):
+    """Inyecta `principal` en la ruta; 404 si el usuario del token ya no existe."""
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        principal = obtener_principal()
+        if principal is None:
+            return jsonify({"msg": "Usuario no encontrado"}), 404
+        return fn(*args, principal=principal, **kwargs)
+    return wrapper
+
+
+def requires_role(*roles):
+    """
+    Autoriza la ruta para los roles indicados ("admin", "proveedor", "lector")
+    e inyecta `principal` con los ids ya resueltos.  Va después de
+    @jwt_required().  El rol se comprueba una vez por petición contra la caché
+    de identidades (invalidada al cambiar de rol), así un ascenso o una
+    revocación no esperan a que caduque el token.  "lector" es cualquier
+    usuario con ficha de lector.
+    """
+    permitidos = {ROLES[r] for r in roles}
+
+    def decorador(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            principal = obtener_principal()
+            if principal is None:
+                return jsonify({"msg": "No autenticado"}), 401
+            if "rol_verificado" not in g:
+                vigente = identidad_service.obtener(principal.email)
+                if vigente:
+                    principal.id_rol = vigente["id_rol"]
+                    principal.id_lec = vigente["id_lec"]
+                g.rol_verificado = vigente is not None
+            autorizado = g.rol_verificado and (
+                principal.id_rol in permitidos
+                or ("lector" in roles and principal.id_lec is not None)
+            )
+            if not autorizado:
+                return jsonify({"msg": f"No autorizado – se requiere rol {' o '.join(r.upper() for r in roles)}"}), 403
+            return fn(*args, principal=principal, **kwargs)
+        return wrapper
+    return decorador
+
 
 def auth():
     email = request.json.get("email", None)
@@ -26,8 +102,11 @@ def auth():
                 return jsonify({"msg": "Error en configuración de cuenta. Contacte al administrador"}), 500
 
             if email == email_almacenado and bcrypt.checkpw(password.encode('utf-8'), hash_almacenado.encode('utf-8')):
-                user = Usuario(usuario['id_user'], email_almacenado, password)
-                access_token = create_access_token(identity=user.email_user, expires_delta=False)
+                user = Usuario(usuario['id_user'], email_almacenado, password, id_rol=id_rol)
+                access_token = crear_token(
+                    user.email_user, user.id, user.id_rol, usuario.get('id_lec'),
+                    expires_delta=False
+                )
                 return jsonify(
                     access_token=access_token,
                     id_rol=id_rol
@@ -0,0 +1,128 @@
+"""
+db/metricas.py
+──────────────
+Instrumentación de consultas SQL.
+
+* Cada `execute` de los cursores entregados por `db.obtener_conexion()` registra
+  la huella de la consulta (SQL sin literales), su duración y las filas.
+* Por petición se acumula un resumen (nº de consultas, tiempo total en BD) que
+  se escribe en el log y en la cabecera `Server-Timing`.
+* Consultas lentas (> DB_SLOW_QUERY_MS) y posibles N+1 (misma huella más de
+  DB_N1_UMBRAL veces en una petición) se avisan con `logger.warning`.
+"""
+
+import logging
+import os
+import re
+import time
+from collections import Counter
+from functools import lru_cache
+
+from flask import g, has_request_context, request
+from flask.logging import default_handler
+
+LENTA_MS  = float(os.getenv("DB_SLOW_QUERY_MS", 200))
+N1_UMBRAL = int(os.getenv("DB_N1_UMBRAL", 5))
+
+logger = logging.getLogger("db.consultas")
+
+_RX_CADENA  = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"")
+_RX_NUMERO  = re.compile(r"\b\d+(?:\.\d+)?\b")
+_RX_LISTA   = re.compile(r"\(\s*(?:\?|%s)(?:\s*,\s*(?:\?|%s))*\s*\)")
+_RX_ESPACIO = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=1024)
+def huella(sql: str) -> str:
+    """`SELECT … WHERE id = 7 AND x IN (1,2,3)` → `SELECT … WHERE id = ? AND x IN (?)`."""
+    if isinstance(sql, bytes):
+        sql = sql.decode("utf-8", "replace")
+    h = _RX_CADENA.sub("?", sql)
+    h = _RX_NUMERO.sub("?", h)
+    h = h.replace("%s", "?")
+    h = _RX_LISTA.sub("(?)", h)
+    return _RX_ESPACIO.sub(" ", h).strip()
+
+
+class _ResumenPeticion:
+    def __init__(self):
+        self.consultas = 0
+        self.total_ms  = 0.0
+        self.huellas   = Counter()
+        self.avisadas  = set()
+
+
+def _resumen():
+    if not has_request_context():
+        return None
+    r = g.get("_db_resumen")
+    if r is None:
+        r = g._db_resumen = _ResumenPeticion()
+    return r
+
+
+def registrar(sql, ms: float, filas: int):
+    h = huella(sql)
+    if ms >= LENTA_MS:
+        logger.warning("Consulta lenta %.1f ms (%s filas): %s", ms, filas, h)
+    r = _resumen()
+    if r is None:
+        return
+    r.consultas += 1
+    r.total_ms  += ms
+    r.huellas[h] += 1
+    if r.huellas[h] > N1_UMBRAL and h not in r.avisadas:
+        r.avisadas.add(h)
+        logger.warning("Posible N+1 en %s %s: %s", request.method, request.path, h)
+
+
+class CursorInstrumentado:
+    """Envoltorio de un cursor PyMySQL que mide cada execute/executemany."""
+
+    def __init__(self, cur):
+        self._cur = cur
+
+    def __getattr__(self, nombre):
+        return getattr(self._cur, nombre)
+
+    def __iter__(self):
+        return iter(self._cur)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._cur.close()
+
+    def execute(self, query, args=None):
+        t0 = time.perf_counter()
+        try:
+            return self._cur.execute(query, args)
+        finally:
+            registrar(query, 1_000 * (time.perf_counter() - t0), self._cur.rowcount)
+
+    def executemany(self, query, args):
+        t0 = time.perf_counter()
+        try:
+            return self._cur.executemany(query, args)
+        finally:
+            registrar(query, 1_000 * (time.perf_counter() - t0), self._cur.rowcount)
+
+
+def init_app(app):
+    """Resumen por petición en el log y en la cabecera Server-Timing."""
+    if not logger.handlers:
+        logger.addHandler(default_handler)
+        logger.setLevel(os.getenv("DB_LOG_LEVEL", "INFO"))
+
+    @app.after_request
+    def _resumen_consultas(response):
+        r = g.pop("_db_resumen", None)
+        if r is not None and r.consultas:
+            response.headers.add(
+                "Server-Timing",
+                f'db;dur={r.total_ms:.1f};desc="{r.consultas} consultas"',
+            )
+            logger.info("%s %s → %d consultas, %.1f ms en BD",
+                        request.method, request.path, r.consultas, r.total_ms)
+        return response
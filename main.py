@@ -19,6 +19,13 @@ import services.lista_deseo_service as lista_deseo_service
 import services.carrito_service as carrito_service
 import services.historieta_service as hist_srv
 import services.usuario_service as usuario_service
+import services.identidad_service as identidad_service
+import services.conversion_service as conversion_service
+import services.precarga_service as precarga_service
+import services.zip_pool_service as zip_pool_service
+import services.cache_service as cache_service
+import services.entrega_service as entrega_service
+import services.ingesta_service as ingesta_service
 import stripe
 import git
 import os
@@ -41,6 +48,11 @@ app.config["JWT_SECRET_KEY"] = "secret"
 app.config['MAX_CONTENT_LENGTH'] = 500 * 1024 * 1024  # 500 MB
 jwt = JWTManager(app)
 
+# Portadas (static/uploads/portadas) delegadas a nginx / apache si ENTREGA_MODO lo pide
+_vista_static = app.view_functions["static"]
+app.view_functions["static"] = lambda filename: entrega_service.servir_estatico(filename, _vista_static)
+db.init_app(app)   # una conexión/transacción por petición compartida por los servicios
+
 sa_path = os.path.join(BASE_DIR, 'db', 'firebase-sa.json')
 
 if not firebase_admin._apps:
@@ -97,6 +109,15 @@ def auth():
 
 from firebase_admin import auth as firebase_auth
 
+# id_user / id_rol / id_lec para los claims del JWT de los logins sociales
+_SQL_IDENTIDAD = """
+    SELECT u.id_user, u.id_rol, l.id_lec
+      FROM usuario u
+      LEFT JOIN lector l ON l.id_user = u.id_user
+     WHERE u.email = %s
+     LIMIT 1
+"""
+
 @app.route("/auth_google", methods=["POST"])
 def auth_google():
     id_token = request.json.get("id_token")
@@ -111,10 +132,12 @@ def auth_google():
         # 2) Comprobamos/creamos al usuario en nuestra BD
         with db.obtener_conexion() as cn, cn.cursor(DictCursor) as cur:
             # ¿Ya existe?
-            cur.execute("SELECT id_user FROM usuario WHERE email = %s", (email,))
+            cur.execute(_SQL_IDENTIDAD, (email,))
             fila = cur.fetchone()
 
-            if not fila:
+            if fila:
+                id_user, id_rol, id_lec = fila["id_user"], fila["id_rol"], fila["id_lec"]
+            else:
                 # a) Insertamos en usuario
                 cur.execute(
                     "INSERT INTO usuario (email, pass, id_rol) VALUES (%s, %s, %s)",
@@ -130,11 +153,13 @@ def auth_google():
                     ("", "", "", new_user_id)
                 )
                 print(f"Lector asociado creado para id_user={new_user_id}")
+                id_user, id_rol, id_lec = new_user_id, 1, cur.lastrowid
 
                 cn.commit()
+                identidad_service.invalidar(email=email)
 
         # 3) Generamos nuestro JWT interno
-        access_token = create_access_token(identity=email)
+        access_token = auth_controller.crear_token(email, id_user, id_rol, id_lec)
         return jsonify({"access_token": access_token}), 200
 
     except Exception as e:
@@ -195,7 +220,7 @@ def auth_twitter():
 
         # 5) Resto del código igual (crear/buscar usuario)
         with db.obtener_conexion() as cn, cn.cursor(DictCursor) as cur:
-            cur.execute("SELECT id_user FROM usuario WHERE email = %s", (email,))
+            cur.execute(_SQL_IDENTIDAD, (email,))
             fila = cur.fetchone()
 
             if not fila:
@@ -211,13 +236,16 @@ def auth_twitter():
                     "VALUES (%s, %s, %s, %s)",
                     ("", "", "", new_user_id)
                 )
+                id_user, id_rol, id_lec = new_user_id, 1, cur.lastrowid
                 cn.commit()
+                identidad_service.invalidar(email=email)
                 print(f"[DEBUG] Usuario creado con ID: {new_user_id}")
             else:
+                id_user, id_rol, id_lec = fila["id_user"], fila["id_rol"], fila["id_lec"]
                 print(f"[DEBUG] Usuario existente encontrado: {fila['id_user']}")
 
         # 6) Generar JWT
-        access_token = create_access_token(identity=email)
+        access_token = auth_controller.crear_token(email, id_user, id_rol, id_lec)
         print(f"[DEBUG] JWT generado para: {email}")
         return jsonify({"access_token": access_token}), 200
 
@@ -256,7 +284,7 @@ def auth_facebook():
         # 5) Conexión a la base de datos
         with db.obtener_conexion() as cn, cn.cursor(DictCursor) as cur:
             # 5a) Buscamos en tabla usuario
-            cur.execute("SELECT id_user FROM usuario WHERE email = %s", (email,))
+            cur.execute(_SQL_IDENTIDAD, (email,))
             fila = cur.fetchone()
 
             if not fila:
@@ -273,28 +301,30 @@ def auth_facebook():
                     "VALUES (%s, %s, %s, %s)",
                     ("", "", "", id_user)
                 )
+                id_rol, id_lec = 1, cur.lastrowid
                 cn.commit()
+                identidad_service.invalidar(email=email)
                 print(f"[DEBUG] Usuario y lector creados con ID: {id_user}")
 
             else:
                 # 5c) Si usuario existe, nos aseguramos de que tenga lector
-                id_user = fila["id_user"]
-                cur.execute("SELECT 1 FROM lector WHERE id_user = %s", (id_user,))
-                lector_existe = cur.fetchone()
-                if not lector_existe:
+                id_user, id_rol, id_lec = fila["id_user"], fila["id_rol"], fila["id_lec"]
+                if id_lec is None:
                     print(f"[DEBUG] Usuario {id_user} existe sin lector. Creando lector...")
                     cur.execute(
                         "INSERT INTO lector (dni_lec, nom_lec, apellidos_lec, id_user) "
                         "VALUES (%s, %s, %s, %s)",
                         ("", "", "", id_user)
                     )
+                    id_lec = cur.lastrowid
                     cn.commit()
+                    identidad_service.invalidar(email=email)
                     print(f"[DEBUG] Lector creado para usuario {id_user}")
                 else:
                     print(f"[DEBUG] Usuario {id_user} ya tiene lector asociado")
 
         # 6) Generar y devolver JWT
-        access_token = create_access_token(identity=email)
+        access_token = auth_controller.crear_token(email, id_user, id_rol, id_lec)
         print(f"[DEBUG] JWT generado para: {email}")
         return jsonify({"access_token": access_token}), 200
 
@@ -342,7 +372,8 @@ def upload_portada():
 
 @app.route("/upload_zip", methods=["POST"])
 @jwt_required()
-def upload_zip():
+@auth_controller.con_principal
+def upload_zip(principal):
     if 'file' not in request.files:
         return jsonify({"msg": "No se recibió archivo"}), 400
 
@@ -354,8 +385,22 @@ def upload_zip():
     path = os.path.join(UPLOAD_FOLDER_ZIPS, filename)
     file.save(path)
 
+    # Verificación, índice y primer capítulo en segundo plano
+    ingesta = ingesta_service.encolar(filename, id_user=principal.id_user)
+
     url = f"{request.host_url}static/uploads/zips/{filename}"
-    return jsonify({"url": url}), 200
+    return jsonify({
+        "url":     url,
+        "estado":  ingesta["estado"],
+        "ingesta": url_for("api_estado_ingesta", filename=filename, _external=True),
+    }), 200
+
+@app.route("/upload_zip/<filename>/estado", methods=["GET"])
+@jwt_required()
+@auth_controller.con_principal
+def api_estado_ingesta(filename, principal):
+    resp, status = ingesta_service.estado(secure_filename(filename), principal)
+    return jsonify(resp), status
 
 @app.route("/solicitudes/<int:id>/chapters", methods=["GET"])
 @jwt_required()
@@ -377,16 +422,10 @@ def api_listar_paginas(id, chapter):
 
 @app.route("/api_aprobar_publicacion", methods=["POST"])
 @jwt_required()
-def api_aprobar_publicacion():
-    # 1) Obtener al usuario autenticado
-    email_admin = get_jwt_identity()          # tu JWT guarda el email
-    if not email_admin:
-        return jsonify({"msg": "No autenticado"}), 401
-
-    # 2) Verificar que es administrador
-    id_admin = admin_service.obtener_id_admin_por_email(email_admin)
-    if id_admin is None:
-        return jsonify({"msg": "No autorizado – se requiere rol ADMIN"}), 403
+@auth_controller.requires_role("admin")
+def api_aprobar_publicacion(principal):
+    # 1-2) Usuario autenticado y con rol ADMIN (lo garantiza requires_role)
+    id_admin = principal.id_user
 
     # 3) Extraer id_solicitud del body JSON
     data = request.get_json(silent=True) or {}
@@ -425,15 +464,11 @@ def api_novedades():
 
 @app.route("/proveedor_dashboard", methods=["GET"])
 @jwt_required()
-def obtener_dashboard_proveedor():
+@auth_controller.requires_role("proveedor", "admin")
+def obtener_dashboard_proveedor(principal):
     # 1) identificamos al proveedor
-    email = get_jwt_identity()
+    id_user = principal.id_user
     with db.obtener_conexion() as cn, cn.cursor(DictCursor) as cur:
-        cur.execute("SELECT id_user FROM usuario WHERE email = %s", (email,))
-        fila = cur.fetchone()
-        if not fila:
-            return jsonify({"msg":"Usuario no encontrado"}), 404
-        id_user = fila["id_user"]
 
         # 2) solicitudes pendientes
         cur.execute("""
@@ -488,7 +523,8 @@ def obtener_dashboard_proveedor():
 
 @app.route("/admin_dashboard", methods=["GET"])
 @jwt_required()
-def api_dashboard_admin():
+@auth_controller.requires_role("admin")
+def api_dashboard_admin(principal):
     with db.obtener_conexion() as conexion:
         with conexion.cursor(DictCursor) as cursor:
 
@@ -550,7 +586,8 @@ def api_por_genero(id_genero):
 
 @app.route("/api_eliminar_venta/<int:id_ven>", methods=["DELETE"])
 @jwt_required()
-def api_eliminar_venta(id_ven):
+@auth_controller.con_principal
+def api_eliminar_venta(id_ven, principal):
     """
     Soft-delete lógico de una venta:
     • Marca fecha_eliminacion = NOW()
@@ -558,18 +595,9 @@ def api_eliminar_venta(id_ven):
     • Protege contra dobles eliminaciones
     """
     try:
-        # 1) Resuelvo el usuario que hace la petición
-        email = get_jwt_identity()
+        # 1) Usuario que hace la petición (claims del JWT)
+        id_user = principal.id_user
         with db.obtener_conexion() as cn, cn.cursor(DictCursor) as cur:
-            cur.execute(
-                "SELECT id_user FROM usuario WHERE email = %s",
-                (email,)
-            )
-            fila = cur.fetchone()
-            if not fila:
-                return jsonify({"success": False, "message": "Usuario no encontrado"}), 404
-            id_user = fila["id_user"] if isinstance(fila, dict) else fila[0]
-
             # 2) Soft-delete: sólo si no estaba ya eliminado
             cur.execute("""
                 UPDATE venta
@@ -604,11 +632,11 @@ def api_ficha(id_vol):
 
 @app.route("/volumenes/<int:id_vol>/chapters", methods=["GET"])
 @jwt_required()
-def api_listar_capitulos_volumen(id_vol):
-    email_user = get_jwt_identity()
-    current_app.logger.debug(f"[api_listar_capitulos_volumen] email: {email_user}, volumen: {id_vol}")
+@auth_controller.con_principal
+def api_listar_capitulos_volumen(id_vol, principal):
+    current_app.logger.debug(f"[api_listar_capitulos_volumen] email: {principal.email}, volumen: {id_vol}")
 
-    comprado = vol_srv.usuario_compro_volumen(email_user, id_vol)
+    comprado = vol_srv.usuario_compro_volumen(principal.id_user, id_vol)
     current_app.logger.debug(f"[api_listar_capitulos_volumen] comprado: {comprado}")
 
     resp, status = vol_srv.listar_capitulos(id_vol)
@@ -640,6 +668,46 @@ def api_pages(id_vol, chapter):
     resp, st = vol_srv.listar_paginas(id_vol, chapter)
     return jsonify(resp), st
 
+@app.route("/volumenes/<int:id_vol>/chapters/<chapter>/thumbs", methods=["GET"])
+def api_thumbs(id_vol, chapter):
+    resp, st = vol_srv.miniaturas(id_vol, chapter)
+    return jsonify(resp), st
+
+@app.route("/volumenes/<int:id_vol>/chapters/<chapter>/thumbs.jpg", methods=["GET"])
+def api_thumbs_sprite(id_vol, chapter):
+    return vol_srv.miniaturas_hoja(id_vol, chapter)
+
+@app.route("/volumenes/<int:id_vol>/informe_paginas", methods=["GET"])
+@jwt_required()
+@auth_controller.requires_role("admin")
+def api_informe_paginas(id_vol, principal):
+    resp, st = vol_srv.informe_paginas(id_vol)
+    return jsonify(resp), st
+
+# descarga offline: permiso comprobado una vez por paquete
+@app.route("/volumenes/<int:id_vol>/chapters/<chapter>/bundle.tar", methods=["GET"])
+@jwt_required()
+@auth_controller.con_principal
+def api_bundle_capitulo(id_vol, chapter, principal):
+    cap = vol_srv.numero_capitulo(chapter)
+    if cap is None:
+        return jsonify({"code": 1, "msg": "Capítulo no encontrado"}), 404
+    if not vol_srv.usuario_compro_volumen(principal.id_user, id_vol):
+        muestra = vol_srv.primer_capitulo(id_vol)
+        if muestra is None:
+            return jsonify({"code": 1, "msg": "Capítulo no encontrado"}), 404
+        if cap != muestra:
+            return jsonify({"code": 1, "msg": "Volumen no comprado"}), 403
+    return vol_srv.paquete(id_vol, chapter)
+
+@app.route("/volumenes/<int:id_vol>/bundle.tar", methods=["GET"])
+@jwt_required()
+@auth_controller.con_principal
+def api_bundle_volumen(id_vol, principal):
+    if not vol_srv.usuario_compro_volumen(principal.id_user, id_vol):
+        return jsonify({"code": 1, "msg": "Volumen no comprado"}), 403
+    return vol_srv.paquete(id_vol)
+
 # imágenes
 @app.route("/volumenes/<int:id>/<chapter>/<filename>")
 def srv_vol_page(id, chapter, filename):
@@ -648,9 +716,9 @@ def srv_vol_page(id, chapter, filename):
 
 @app.route("/carrito", methods=["GET"])
 @jwt_required()
-def api_listar_carrito():
-    id_user = get_jwt_identity()           # según tu auth
-    resp, status = carrito_service.listar_carrito(id_user)
+@auth_controller.con_principal
+def api_listar_carrito(principal):
+    resp, status = carrito_service.listar_carrito(principal.id_user)
     return jsonify(resp), status
 
 
@@ -658,9 +726,10 @@ from services.lector_vol_service import usuario_compro_volumen
 
 @app.route("/carrito/agregar", methods=["POST"])
 @jwt_required()
-def api_agregar_carrito():
+@auth_controller.con_principal
+def api_agregar_carrito(principal):
     data        = request.json or {}
-    id_user     = get_jwt_identity()
+    id_user     = principal.id_user
     id_volumen  = data.get("id_volumen")
     cant        = data.get("cantidad", 1)
 
@@ -668,8 +737,7 @@ def api_agregar_carrito():
         return jsonify({"msg": "Falta id_volumen"}), 400
 
     # Verificar si el volumen ya fue comprado
-    email_user = id_user  # si `get_jwt_identity()` retorna email
-    if usuario_compro_volumen(email_user, id_volumen):
+    if usuario_compro_volumen(id_user, id_volumen):
         return jsonify({"msg": "Ya compraste este volumen"}), 400
 
     resp, st = carrito_service.agregar_al_carrito(id_user, id_volumen, cant)
@@ -678,9 +746,10 @@ def api_agregar_carrito():
 
 @app.route("/carrito/item", methods=["PUT"])
 @jwt_required()
-def api_actualizar_cantidad():
+@auth_controller.con_principal
+def api_actualizar_cantidad(principal):
     d        = request.json or {}
-    id_user  = get_jwt_identity()
+    id_user  = principal.id_user
     resp, st = carrito_service.actualizar_cantidad(
         id_user,
         d.get("id_historieta"),
@@ -691,8 +760,9 @@ def api_actualizar_cantidad():
 
 @app.route("/carrito/item", methods=["DELETE"])
 @jwt_required()
-def api_eliminar_item():
-    id_user    = get_jwt_identity()
+@auth_controller.con_principal
+def api_eliminar_item(principal):
+    id_user    = principal.id_user
     id_volumen = request.args.get("id_volumen", type=int)  # antes eras id_historieta
 
     if id_volumen is None:
@@ -705,8 +775,9 @@ def api_eliminar_item():
 
 @app.route("/carrito/vaciar", methods=["POST"])
 @jwt_required()
-def api_vaciar_carrito():
-    id_user  = get_jwt_identity()
+@auth_controller.con_principal
+def api_vaciar_carrito(principal):
+    id_user  = principal.id_user
     resp, st = carrito_service.vaciar_carrito(id_user)
     return jsonify(resp), st
 
@@ -719,6 +790,22 @@ def api_test():
     }), 200
 
 
+@app.route("/api_metricas", methods=["GET"])
+@jwt_required()
+@auth_controller.requires_role("admin")
+def api_metricas(principal):
+    """Estado interno de este worker (para dimensionar pools y cachés)."""
+    return jsonify({
+        "pid":     os.getpid(),
+        "db_pool": db.estadisticas_pool(),
+        "identidad_cache": identidad_service.estadisticas(),
+        "conversion": conversion_service.estadisticas(),
+        "precarga":   precarga_service.estadisticas(),
+        "zip_pool":   zip_pool_service.estadisticas(),
+        "cache":      cache_service.estadisticas(),
+    }), 200
+
+
 
 @app.route("/protected", methods=["GET"])
 @jwt_required()
@@ -750,39 +837,44 @@ def eliminar_solicitud_proveedor():
 
 @app.route("/api_rechazar_solicitud_publicacion", methods=["POST"])
 @jwt_required()
-def rechazar_solicitud_publicacion():
+@auth_controller.requires_role("admin")
+def rechazar_solicitud_publicacion(principal):
     data = request.get_json(silent=True) or {}
     if "id_solicitud" not in data:
         return jsonify({"code": 1, "msg": "Datos de rechazo no proporcionados"}), 400
     id_solicitud = data["id_solicitud"]
-    return proveedor_service.rechazar_solicitud_publicacion(id_solicitud)
+    return proveedor_service.rechazar_solicitud_publicacion(id_solicitud, id_admin=principal.id_user)
 
 
 @app.route("/api_registrar_administrador", methods=["POST"])
 @jwt_required()
-def registrar_administrador():
+@auth_controller.requires_role("admin")
+def registrar_administrador(principal):
     return admin_controller.registrarAdministrador()
 
 @app.route("/api_aprobar_proveedor", methods=["POST"])
 @jwt_required()
-def registrar_proveedor():
+@auth_controller.requires_role("admin")
+def registrar_proveedor(principal):
     return admin_controller.aprobar_proveedor()
 
 @app.route("/api_rechazar_proveedor", methods=["POST"])
 @jwt_required()
-def rechaza_proveedor():
+@auth_controller.requires_role("admin")
+def rechaza_proveedor(principal):
     data = request.get_json()
     id_objetivo = data.get("id_user")
     if id_objetivo is None:
         return jsonify({"msg": "Falta el id_user del usuario a rechazar"}), 400
 
     # llamamos a un servicio que trabaja por ID, no por email
-    respuesta, status = admin_service.rechazar_proveedor_por_id(id_objetivo)
+    respuesta, status = admin_service.rechazar_proveedor_por_id(id_objetivo, id_admin=principal.id_user)
     return jsonify(respuesta), status
 
 @app.route("/api_obtener_proveedor")
 @jwt_required()
-def obtener_proveedor():
+@auth_controller.requires_role("admin")
+def obtener_proveedor(principal):
     respuesta, status = admin_controller.get_solicitudes_proveedor()
     return jsonify(respuesta), status
 
@@ -805,7 +897,7 @@ def lista_busqueda():
         user_identity = get_jwt_identity()
         q = request.args.get('q', '').strip()
 
-        with db.obtener_conexion() as conexion:
+        with db.obtener_conexion(solo_lectura=True) as conexion:
             with conexion.cursor(DictCursor) as cursor:
                 sql = """
                     SELECT
@@ -837,8 +929,10 @@ def insertar_solicitud():
     data = request.get_json(silent=True) or {}
     if not data:
         return jsonify({"code": 1, "msg": "Datos de solicitud no proporcionados"}), 400
-    email_user = get_jwt_identity()
-    return proveedor_service.registrar_solicitud(email_user, data)
+    principal = auth_controller.obtener_principal()
+    if principal is None:
+        return jsonify({"code": 1, "msg": "Usuario no encontrado"}), 404
+    return proveedor_service.registrar_solicitud(principal.email, data, id_user=principal.id_user)
 
 
 # @app.route("/api_aprobar_publicacion", methods=["POST"])
@@ -892,7 +986,8 @@ def obtener_usuario_data():
 
 @app.route("/api_solicitud_publicacion/<int:id_solicitud>", methods=["GET"])
 @jwt_required()
-def obtener_solicitud_historieta_por_id(id_solicitud):
+@auth_controller.requires_role("admin")
+def obtener_solicitud_historieta_por_id(id_solicitud, principal):
     resultado = admin_service.obtener_solicitud_publicacion_por_id(id_solicitud)
     if resultado:
         return jsonify(resultado), 200
@@ -901,7 +996,8 @@ def obtener_solicitud_historieta_por_id(id_solicitud):
     
 @app.route("/api_obtener_solicitud_historieta", methods=["GET"])
 @jwt_required()
-def api_obtener_solicitud_historieta():
+@auth_controller.requires_role("admin")
+def api_obtener_solicitud_historieta(principal):
     """
     GET /api_obtener_solicitud_historieta
     Devuelve todas las solicitudes de publicación de historietas en estado 'pendiente'.
@@ -926,29 +1022,18 @@ def obtener_crear_comentario():
     data = request.get_json(silent=True) or {}
     id_historieta = data.get("id_historieta")
     texto         = data.get("comentario", "").strip()
-    email    = get_jwt_identity()   # tu JWT guarda el email
+    principal     = auth_controller.obtener_principal()   # id_lec viene en el JWT
 
     # Validaciones básicas
     if not id_historieta or not texto:
         return jsonify({"msg": "id_historieta y comentario son obligatorios"}), 400
+    if principal is None or principal.id_lec is None:
+        return jsonify({"msg": "No eres un lector registrado"}), 403
+    id_lec = principal.id_lec
 
     try:
         with db.obtener_conexion() as conexion:
             with conexion.cursor() as cursor:
-                # Recuperar id_lec a partir del email
-                cursor.execute(
-                    """
-                    SELECT l.id_lec
-                      FROM lector l
-                      JOIN usuario u ON l.id_user = u.id_user
-                     WHERE u.email = %s
-                    """,
-                    (email,)
-                )
-                fila = cursor.fetchone()
-                if not fila:
-                    return jsonify({"msg": "No eres un lector registrado"}), 403
-                id_lec = fila[0] if isinstance(fila, (list, tuple)) else fila["id_lec"]
                 # Insertar el comentario
                 sql_insert = """
                     INSERT INTO comentario (id_historieta, id_lec, comentario)
@@ -977,7 +1062,8 @@ def get_comentarios(id_historieta):
 
 @app.route("/api_devolucion", methods=["POST"])
 @jwt_required()
-def api_devolucion():
+@auth_controller.con_principal
+def api_devolucion(principal):
     data = request.get_json(force=True)
     id_ven = data.get("id_ven")
     motivo = data.get("motivo", "")
@@ -991,15 +1077,7 @@ def api_devolucion():
         return jsonify({"msg": "Venta no encontrada"}), 404
 
     # 2) Verificar que la venta pertenece al usuario autenticado
-    email_user = get_jwt_identity()
-    with db.obtener_conexion() as cn, cn.cursor() as cur:
-        cur.execute("SELECT id_user FROM usuario WHERE email = %s", (email_user,))
-        user_row = cur.fetchone()
-    
-    if not user_row:
-        return jsonify({"msg": "Usuario no encontrado"}), 404
-    
-    user_id = user_row["id_user"] if isinstance(user_row, dict) else user_row[0]
+    user_id = principal.id_user
     
     # 3) Validar que la venta pertenece al usuario y está en estado válido
     if venta["id_user"] != user_id or venta["estado_ven"] != 1:
@@ -1025,16 +1103,11 @@ def api_devolucion():
 @app.route("/api/users/items", methods=["GET"])
 @jwt_required()
 def api_get_items():
-    # 1) Extraemos el email del JWT
-    email = get_jwt_identity()
-
-    # 2) Resolvemos el id_user
-    with db.obtener_conexion() as cn, cn.cursor() as cur:
-        cur.execute("SELECT id_user FROM usuario WHERE email = %s", (email,))
-        fila = cur.fetchone()
-    if not fila:
+    # 1-2) id_user desde los claims del JWT
+    principal = auth_controller.obtener_principal()
+    if principal is None:
         return jsonify({"success": False, "message": "Usuario no encontrado"}), 404
-    id_user = fila["id_user"] if isinstance(fila, dict) else fila[0]
+    id_user = principal.id_user
 
     # 3) Llamamos al servicio
     tipo = request.args.get('type', 'purchases')
@@ -1102,15 +1175,12 @@ def api_guardar_venta():
     if intent.status != "succeeded":
         return jsonify({"code": 1, "msg": "Pago no confirmado"}), 400
 
-    # 3) Resuelve id_user a partir del email del JWT
-    email = get_jwt_identity()
-    with db.obtener_conexion() as cn, cn.cursor(DictCursor) as cur:
-        cur.execute("SELECT id_user FROM usuario WHERE email = %s", (email,))
-        fila = cur.fetchone()
-    if not fila:
+    # 3) id_user desde los claims del JWT
+    principal = auth_controller.obtener_principal()
+    if principal is None:
         return jsonify({"code": 1, "msg": "Usuario no encontrado"}), 404
 
-    id_user = fila["id_user"] if isinstance(fila, dict) else fila[0]
+    id_user = principal.id_user
 
     # 4) Confirma y registra la venta (tu servicio se encarga del INSERT original)
     try:
@@ -1143,13 +1213,8 @@ def api_guardar_venta():
 
 
 def _resolve_id_user_from_jwt():
-    email = get_jwt_identity()
-    with db.obtener_conexion() as cn, cn.cursor() as cur:
-        cur.execute("SELECT id_user FROM usuario WHERE email = %s", (email,))
-        fila = cur.fetchone()
-    if not fila:
-        return None
-    return fila["id_user"] if isinstance(fila, dict) else fila[0]
+    principal = auth_controller.obtener_principal()
+    return principal.id_user if principal else None
 
 @app.route("/api_agregar_wishlist", methods=["POST"])
 @jwt_required()
@@ -1187,18 +1252,18 @@ def api_payment_sheet():
     if amount_cents <= 0:
         return jsonify({"msg": "amount_cents inválido"}), 400
 
-    # 1) Resuelve id_user
-    email = get_jwt_identity()
-    with db.obtener_conexion() as cn, cn.cursor() as cur:
-        cur.execute("SELECT id_user FROM usuario WHERE email = %s", (email,))
-        fila = cur.fetchone()
-    if not fila:
+    # 1) Resuelve id_user (claims del JWT)
+    principal = auth_controller.obtener_principal()
+    if principal is None:
         return jsonify({"msg": "Usuario no encontrado"}), 404
-    id_user = fila["id_user"] if isinstance(fila, dict) else fila[0]
+    id_user = principal.id_user
+    email   = principal.email
 
-    # 2) Inserta venta preliminar y obtén order_id
+    # 2) Inserta venta preliminar y obtén order_id; se confirma YA, antes de
+    #    crear el PaymentIntent (el COMMIT de after_request llegaría tarde)
     try:
         order_id = venta_service.crear_pedido_preliminar(id_user, amount_cents)
+        db.confirmar_ya()
     except Exception:
         current_app.logger.exception("crear_pedido_preliminar")
         return jsonify({"msg": "Error al crear pedido preliminar"}), 500
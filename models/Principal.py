@@ -0,0 +1,35 @@
+ROL_LECTOR    = 1
+ROL_PROVEEDOR = 2
+ROL_ADMIN     = 3
+
+
+class Principal(object):
+    """Usuario autenticado de la petición (sacado del JWT, sin ir a la BD)."""
+
+    def __init__(self, email, id_user, id_rol=None, id_lec=None):
+        self.email = email
+        self.id_user = id_user
+        self.id_rol = id_rol
+        self.id_lec = id_lec
+
+    @property
+    def es_admin(self):
+        return self.id_rol == ROL_ADMIN
+
+    @property
+    def es_proveedor(self):
+        return self.id_rol == ROL_PROVEEDOR
+
+    def claims(self):
+        """Claims adicionales que viajan en el access token."""
+        return {
+            "id_user": self.id_user,
+            "id_rol": self.id_rol,
+            "id_lec": self.id_lec
+        }
+
+    def __str__(self):
+        return f"Principal(id_user={self.id_user}, email='{self.email}', id_rol={self.id_rol})"
+
+    def json(self):
+        return {"email": self.email, **self.claims()}
@@ -1,5 +1,6 @@
 import pymysql
 import db.database as db
+import services.identidad_service as identidad_service
 import threading
 import requests
 import zipfile
@@ -33,6 +34,7 @@ def aprobar_proveedor(id_user, id_rol_proveedor=2):
                 )
 
             conexion.commit()
+        identidad_service.invalidar(email=email, id_user=id_user)
         return True
     except Exception as e:
         print("Error al aprobar proveedor:", e)
@@ -60,20 +62,14 @@ def rechazar_proveedor(id_user):
         print("Error al rechazar proveedor:", e)
         return {"msg": "Error interno del servidor"}, 500
 
-def rechazar_proveedor_por_id(id_user):
+def rechazar_proveedor_por_id(id_user, id_admin=None):
     try:
-        # 0) Obtengo el id del admin que rechaza desde el JWT
-        email_admin = get_jwt_identity()
+        # 0) Obtengo el id del admin que rechaza desde el JWT (si la ruta no lo resolvió ya)
+        if id_admin is None:
+            id_admin = identidad_service.id_user_por_email(get_jwt_identity())
+        if id_admin is None:
+            return {"msg": "Admin no encontrado"}, 403
         with db.obtener_conexion() as conexion, conexion.cursor(DictCursor) as cursor:
-            cursor.execute(
-                "SELECT id_user FROM usuario WHERE email = %s",
-                (email_admin,)
-            )
-            admin_row = cursor.fetchone()
-            if not admin_row:
-                return {"msg": "Admin no encontrado"}, 403
-            id_admin = admin_row["id_user"] if isinstance(admin_row, dict) else admin_row[0]
-
             # 1) Verifico estado actual
             cursor.execute(
                 "SELECT proveedor_solicitud, proveedor_aprobado "
@@ -275,6 +271,7 @@ def agregar_administrador(id_user, id_rol=3):
                     (id_rol, id_user)
                 )
             conexion.commit()
+        identidad_service.invalidar(id_user=id_user)
         return {"success": True, "message": "Usuario actualizado a administrador."}
     except Exception as e:
         print("Error: ", e)
@@ -282,15 +279,9 @@ def agregar_administrador(id_user, id_rol=3):
 
 def obtener_id_admin_por_email(email):
     try:
-        with db.obtener_conexion() as conexion:
-            with conexion.cursor(DictCursor) as cursor:
-                cursor.execute(
-                    "SELECT id_user FROM usuario WHERE email = %s AND id_rol = 3",
-                    (email,)
-                )
-                resultado = cursor.fetchone()
-                if resultado:
-                    return resultado["id_user"]
+        identidad = identidad_service.obtener(email)
+        if identidad and identidad["id_rol"] == 3:
+            return identidad["id_user"]
         return None
     except Exception as e:
         print("Error al obtener ID de administrador por email:", e)
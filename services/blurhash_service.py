@@ -0,0 +1,66 @@
+# services/blurhash_service.py
+"""
+Codificador BlurHash (https://blurha.sh) vectorizado con NumPy.
+
+Un BlurHash es una cadena de ~30 caracteres con unas pocas componentes DCT
+de la imagen; el móvil la pinta como marcador difuminado mientras llega la
+página.  Se calcula sobre la miniatura que ya se decodifica para la hoja del
+capítulo (conversion_service._sprite), así que cuesta solo el producto de
+matrices: cos(x) · píxeles · cos(y) para todas las componentes a la vez.
+"""
+from __future__ import annotations
+import numpy as np
+
+BASE83 = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~"
+
+
+# ───── helpers ───────────────────────────────────────────────────────────────
+def _b83(valor: int, longitud: int) -> str:
+    return "".join(BASE83[(valor // 83 ** (longitud - 1 - i)) % 83] for i in range(longitud))
+
+
+def _a_lineal(srgb: np.ndarray) -> np.ndarray:
+    v = srgb / 255.0
+    return np.where(v <= 0.04045, v / 12.92, ((v + 0.055) / 1.055) ** 2.4)
+
+
+def _a_srgb(v: float) -> int:
+    v = min(1.0, max(0.0, v))
+    if v <= 0.0031308:
+        return int(v * 12.92 * 255 + 0.5)
+    return int((1.055 * v ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+
+# ───── API ───────────────────────────────────────────────────────────────────
+def codificar(img, componentes_x: int | None = None, componentes_y: int | None = None) -> str:
+    """
+    BlurHash de una imagen PIL RGB pequeña (miniatura).  Por defecto 3×4
+    componentes en páginas verticales y 4×3 en horizontales.
+    """
+    ancho, alto = img.size
+    cx = componentes_x or (4 if ancho >= alto else 3)
+    cy = componentes_y or (3 if ancho >= alto else 4)
+
+    lineal = _a_lineal(np.asarray(img.convert("RGB"), dtype=np.float64))     # (alto, ancho, 3)
+    base_x = np.cos(np.pi * np.outer(np.arange(cx), np.arange(ancho)) / ancho)   # (cx, ancho)
+    base_y = np.cos(np.pi * np.outer(np.arange(cy), np.arange(alto)) / alto)     # (cy, alto)
+    factores = np.einsum("jy,ix,yxc->jic", base_y, base_x, lineal) / (ancho * alto)
+    factores[1:, :] *= 2                                  # normalización: 1 solo para (0, 0)
+    factores[0, 1:] *= 2
+    factores = factores.reshape(cx * cy, 3)               # orden fila a fila, como la referencia
+
+    dc, ac = factores[0], factores[1:]
+    res = _b83((cx - 1) + (cy - 1) * 9, 1)
+    if len(ac):
+        q_max = int(max(0, min(82, np.floor(np.abs(ac).max() * 166 - 0.5))))
+        maximo = (q_max + 1) / 166
+        res += _b83(q_max, 1)
+    else:
+        maximo = 1.0
+        res += _b83(0, 1)
+
+    res += _b83((_a_srgb(dc[0]) << 16) + (_a_srgb(dc[1]) << 8) + _a_srgb(dc[2]), 4)
+    cuant = np.clip(np.floor(np.sign(ac) * np.abs(ac / maximo) ** 0.5 * 9 + 9.5), 0, 18).astype(int)
+    for r, g, b in cuant:
+        res += _b83(r * 19 * 19 + g * 19 + b, 2)
+    return res
@@ -0,0 +1,300 @@
+# services/cache_service.py
+"""
+Gestor de tamaño de static/cache (LRU por capítulo).
+
+La caché de páginas crecía sin límite hasta agotar la cuota de disco.
+
+* Presupuesto CACHE_MAX_BYTES; al superarlo se desalojan capítulos enteros
+  (`<huella>/cNNN/`) empezando por los leídos hace más tiempo, hasta bajar a
+  CACHE_OBJETIVO × presupuesto.
+* Recencia barata: servir una página solo apunta la hora en un dict en
+  memoria (sin `stat`).  Cada CACHE_BARRIDO_S segundos cada worker vuelca sus
+  accesos a un diario propio (`_accesos/<pid>-<n>.json`, nunca se reescribe)
+  y el que consigue el lock de barrido los consolida y desaloja.
+* Fijados: el primer capítulo de cada ZIP (`c001`) y todos los capítulos de
+  los CACHE_FIJAR_TENDENCIA ZIP más leídos últimamente (los contadores se
+  reducen a la mitad en cada barrido), más los que `fijar()` protege mientras
+  dura una descarga (un archivo en `_fijos/` que ven todos los workers; caduca
+  a los CACHE_FIJAR_MAX_S segundos aunque nadie lo suelte).
+* Seguro con lectores activos: el capítulo se renombra a `_papelera/` (atómico)
+  antes de borrarlo, los archivos ya abiertos se siguen leyendo y no se toca
+  nada modificado o leído en los últimos CACHE_GRACIA_S segundos.  Si aun así
+  una página desaparece entre la comprobación y el envío, pagina_service la
+  regenera.
+"""
+from __future__ import annotations
+import itertools, json, logging, os, shutil, tempfile, threading, time, uuid
+from typing import Dict, Optional
+
+try:
+    import fcntl
+except ImportError:                      # Windows
+    fcntl = None
+
+BASE_DIR    = os.path.abspath(os.path.dirname(__file__))
+CACHE_DIR   = os.path.join(BASE_DIR, "..", "static", "cache")
+ACCESOS_DIR = os.path.join(CACHE_DIR, "_accesos")
+PAPELERA    = os.path.join(CACHE_DIR, "_papelera")
+FIJOS_DIR   = os.path.join(CACHE_DIR, "_fijos")
+LOCK_PATH   = os.path.join(CACHE_DIR, "_locks", "barrido.lock")
+CONSOLIDADO = os.path.join(ACCESOS_DIR, "consolidado.json")
+
+MAX_BYTES  = int(os.getenv("CACHE_MAX_BYTES", 5 * 1024 ** 3))
+OBJETIVO   = float(os.getenv("CACHE_OBJETIVO", 0.9))
+INTERVALO  = float(os.getenv("CACHE_BARRIDO_S", 300))
+GRACIA     = float(os.getenv("CACHE_GRACIA_S", 120))
+TENDENCIA  = int(os.getenv("CACHE_FIJAR_TENDENCIA", 20))
+FIJAR_MAX  = float(os.getenv("CACHE_FIJAR_MAX_S", 3600))
+
+logger = logging.getLogger(__name__)
+
+_lock      = threading.Lock()
+_barrido   = threading.Lock()
+_accesos: Dict[str, list] = {}          # "huella/cNNN" → [último acceso, lecturas] sin volcar
+_secuencia = itertools.count()
+_hilo_pid: Optional[int] = None
+_stats     = {"aciertos": 0, "fallos": 0, "desalojos": 0, "bytes_desalojados": 0, "barridos": 0}
+_ultimo    = {"bytes": None, "capitulos": None, "fijados": None, "fecha": None}
+
+
+# ───── helpers ───────────────────────────────────────────────────────────────
+def _clave(ruta: str) -> Optional[str]:
+    """Ruta de un archivo de la caché → 'huella/cNNN' (None si no es de un capítulo)."""
+    partes = os.path.relpath(os.path.dirname(ruta), CACHE_DIR).split(os.sep)
+    if len(partes) != 2 or partes[0].startswith(("_", ".")):
+        return None
+    return "/".join(partes)
+
+
+def _escribir_json(ruta: str, datos) -> None:
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(ruta), suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as fh:
+        json.dump(datos, fh, separators=(",", ":"))
+    os.replace(tmp, ruta)
+
+
+def _leer_json(ruta: str) -> Dict:
+    try:
+        with open(ruta, encoding="utf-8") as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return {}
+
+
+def _volcar() -> None:
+    """Accesos en memoria → diario nuevo de este proceso."""
+    with _lock:
+        pendientes = dict(_accesos)
+        _accesos.clear()
+    if pendientes:
+        _escribir_json(
+            os.path.join(ACCESOS_DIR, f"{os.getpid()}-{next(_secuencia)}.json"), pendientes
+        )
+
+
+def _consolidar() -> Dict[str, list]:
+    """Funde los diarios en consolidado.json (máx. fecha, suma de lecturas con decaimiento)."""
+    total = {k: [v[0], v[1] / 2] for k, v in _leer_json(CONSOLIDADO).items()}
+    leidos = []
+    for nombre in os.listdir(ACCESOS_DIR) if os.path.isdir(ACCESOS_DIR) else ():
+        ruta = os.path.join(ACCESOS_DIR, nombre)
+        if not nombre.endswith(".json") or ruta == CONSOLIDADO:
+            continue
+        for clave, (ts, lecturas) in _leer_json(ruta).items():
+            e = total.setdefault(clave, [0, 0])
+            e[0], e[1] = max(e[0], ts), e[1] + lecturas
+        leidos.append(ruta)
+    _escribir_json(CONSOLIDADO, total)
+    for ruta in leidos:
+        try:
+            os.unlink(ruta)
+        except OSError:
+            pass
+    return total
+
+
+def _tamano(ruta: str) -> int:
+    total = 0
+    with os.scandir(ruta) as it:
+        for e in it:
+            if e.is_file(follow_symlinks=False):
+                total += e.stat(follow_symlinks=False).st_size
+    return total
+
+
+def _capitulos(accesos: Dict[str, list]):
+    """[(clave, ruta, bytes, último uso)] de todos los capítulos en disco."""
+    res = []
+    if not os.path.isdir(CACHE_DIR):
+        return res
+    with os.scandir(CACHE_DIR) as zips:
+        for z in zips:
+            if not z.is_dir() or z.name.startswith(("_", ".")):
+                continue
+            with os.scandir(z.path) as caps:
+                for c in caps:
+                    if not c.is_dir():
+                        continue
+                    clave = f"{z.name}/{c.name}"
+                    uso = max(accesos.get(clave, (0,))[0], c.stat().st_mtime)
+                    res.append((clave, c.path, _tamano(c.path), uso))
+    return res
+
+
+def _eliminar(ruta: str) -> None:
+    """Renombrar (atómico) y luego borrar: nadie ve un capítulo a medio borrar."""
+    os.makedirs(PAPELERA, exist_ok=True)
+    destino = os.path.join(PAPELERA, uuid.uuid4().hex)
+    os.rename(ruta, destino)
+    shutil.rmtree(destino, ignore_errors=True)
+
+
+def _fijados(capitulos, accesos: Dict[str, list]) -> set:
+    por_zip: Dict[str, float] = {}
+    for clave, (_, lecturas) in accesos.items():
+        z = clave.split("/")[0]
+        por_zip[z] = por_zip.get(z, 0) + lecturas
+    tendencia = set(sorted(por_zip, key=por_zip.get, reverse=True)[:TENDENCIA])
+    return {
+        clave for clave, *_ in capitulos
+        if clave.endswith("/c001") or clave.split("/")[0] in tendencia
+    }
+
+
+def _fijos() -> set:
+    """Capítulos fijados con `fijar()` en cualquier worker; borra los caducados."""
+    claves, ahora = set(), time.time()
+    for nombre in os.listdir(FIJOS_DIR) if os.path.isdir(FIJOS_DIR) else ():
+        ruta = os.path.join(FIJOS_DIR, nombre)
+        datos = _leer_json(ruta)
+        if datos.get("hasta", 0) > ahora:
+            claves.update(datos.get("claves", ()))
+        elif nombre.endswith(".json"):
+            try:
+                os.unlink(ruta)
+            except OSError:
+                pass
+    return claves
+
+
+def _bucle() -> None:
+    while True:
+        time.sleep(INTERVALO)
+        try:
+            barrer()
+        except Exception:
+            logger.exception("Barrido de caché falló")
+
+
+def _arrancar() -> None:
+    global _hilo_pid
+    if _hilo_pid == os.getpid() or MAX_BYTES <= 0:
+        return
+    _hilo_pid = os.getpid()
+    threading.Thread(target=_bucle, name="cache-barrido", daemon=True).start()
+
+
+# ───── API ───────────────────────────────────────────────────────────────────
+def tocar(ruta: str, acierto: Optional[bool] = None) -> None:
+    """Registra la lectura de `ruta` (archivo de la caché).  Solo memoria."""
+    clave = _clave(ruta)
+    with _lock:
+        if acierto is not None:
+            _stats["aciertos" if acierto else "fallos"] += 1
+        if clave is not None:
+            e = _accesos.setdefault(clave, [0, 0])
+            e[0] = time.time()
+            e[1] += 1
+    _arrancar()
+
+
+def fijar(rutas, segundos: float = FIJAR_MAX) -> Optional[str]:
+    """
+    Protege del desalojo los capítulos de `rutas` (archivos de la caché) hasta
+    `soltar(testigo)` o como mucho `segundos`.  Devuelve el testigo.
+    """
+    claves = sorted({c for c in map(_clave, rutas) if c is not None})
+    if not claves:
+        return None
+    testigo = os.path.join(FIJOS_DIR, f"{os.getpid()}-{uuid.uuid4().hex}.json")
+    _escribir_json(testigo, {"claves": claves, "hasta": time.time() + segundos})
+    return testigo
+
+
+def soltar(testigo: Optional[str]) -> None:
+    if testigo is None:
+        return
+    try:
+        os.unlink(testigo)
+    except OSError:
+        pass
+
+
+def barrer() -> Dict:
+    """Vuelca accesos y, si nadie más está barriendo, desaloja hasta el objetivo."""
+    _volcar()
+    if not _barrido.acquire(blocking=False):
+        return {"barrido": False}
+    fd = None
+    try:
+        if fcntl is not None:
+            os.makedirs(os.path.dirname(LOCK_PATH), exist_ok=True)
+            fd = os.open(LOCK_PATH, os.O_CREAT | os.O_RDWR, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return {"barrido": False}             # otro worker está en ello
+
+        accesos   = _consolidar()
+        capitulos = _capitulos(accesos)
+        fijados   = _fijados(capitulos, accesos) | _fijos()
+        total     = sum(c[2] for c in capitulos)
+        limite    = time.time() - GRACIA
+        desalojados = 0
+
+        if total > MAX_BYTES:
+            objetivo = MAX_BYTES * OBJETIVO
+            for clave, ruta, tamano, uso in sorted(capitulos, key=lambda c: c[3]):
+                if total <= objetivo:
+                    break
+                if clave in fijados or uso > limite:
+                    continue
+                try:
+                    _eliminar(ruta)
+                except OSError:
+                    continue
+                total -= tamano
+                desalojados += 1
+                accesos.pop(clave, None)
+                with _lock:
+                    _stats["desalojos"] += 1
+                    _stats["bytes_desalojados"] += tamano
+            if desalojados:
+                logger.info("Caché: %d capítulos desalojados, quedan %.1f MB",
+                            desalojados, total / 1024 ** 2)
+
+        en_disco = {c[0] for c in capitulos}
+        _escribir_json(CONSOLIDADO, {k: v for k, v in accesos.items() if k in en_disco})
+
+        with _lock:
+            _stats["barridos"] += 1
+            _ultimo.update(bytes=total, capitulos=len(capitulos) - desalojados,
+                           fijados=len(fijados), fecha=time.time())
+        return {"barrido": True, "bytes": total, "desalojados": desalojados}
+    finally:
+        if fd is not None:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+        _barrido.release()
+
+
+def estadisticas() -> Dict:
+    with _lock:
+        vistas = _stats["aciertos"] + _stats["fallos"]
+        return {
+            **_stats,
+            "ratio_aciertos": round(_stats["aciertos"] / vistas, 3) if vistas else None,
+            "max_bytes": MAX_BYTES,
+            "ultimo_barrido": dict(_ultimo),
+        }
@@ -4,6 +4,7 @@ from typing import Tuple, Dict, Union
 
 from pymysql.cursors import DictCursor
 import db.database as db
+import services.identidad_service as identidad_service
 
 
 def _resolve_user_id(user: Union[int, str]) -> int:
@@ -12,15 +13,10 @@ def _resolve_user_id(user: Union[int, str]) -> int:
     """
     if isinstance(user, int):
         return user
-    with db.obtener_conexion() as cn, cn.cursor(DictCursor) as cur:
-        cur.execute(
-            "SELECT id_user FROM usuario WHERE email=%s",
-            (user,)
-        )
-        row = cur.fetchone()
-    if not row:
+    id_user = identidad_service.id_user_por_email(user)
+    if id_user is None:
         raise ValueError(f"Usuario no encontrado: {user}")
-    return row["id_user"]
+    return id_user
 
 
 def _obtener_o_crear_carrito(user: Union[int, str]) -> int:
@@ -0,0 +1,243 @@
+# services/catalogo_service.py
+"""
+Índice persistente del catálogo de capítulos de cada ZIP.
+
+Detectar capítulos obliga a leer todo el directorio central del ZIP
+(100–500 MB) y pasar las reglas regex por cada entrada.  El resultado se
+guarda en un JSON junto a la caché (`static/cache/_indices/<zip>.json`) con:
+
+* tamaño y mtime del ZIP  → validación barata con un solo `stat`;
+* huella del contenido    → SHA-1 del directorio central (incluye el CRC de
+                            cada miembro): si el ZIP se copia o se "toca"
+                            sin cambiar, no se reconstruye;
+* firma de las reglas     → si cambia rules.yml se vuelve a detectar;
+* capítulo → rutas internas ordenadas;
+* página → cabecera sondeada (formato, modo, tamaño) para decidir si se
+  puede servir sin recodificar;
+* rendición → [bytes, mtime_ns, hash del contenido] del archivo ya generado
+  en la caché (`rendiciones`) y página → BlurHash (`placeholders`), que la
+  precarga va añadiendo para que el manifiesto y los ETag de las páginas no
+  tengan que abrir nada.
+
+Todos los workers lo cargan en O(capítulos) y solo uno lo reconstruye cuando
+el ZIP cambia de verdad (bajo el flock del índice; los demás esperan y leen
+el resultado).  La copia en memoria de cada worker se valida con el `stat` del
+ZIP y el del JSON, así que ve las rendiciones y BlurHash que añaden los otros.
+"""
+from __future__ import annotations
+import hashlib, json, logging, os, tempfile, threading, zipfile
+from contextlib import contextmanager
+from typing import Callable, Dict, List
+
+try:
+    import fcntl
+except ImportError:                      # Windows
+    fcntl = None
+
+import services.zip_pool_service as zip_pool_service
+
+BASE_DIR   = os.path.abspath(os.path.dirname(__file__))
+CACHE_DIR  = os.path.join(BASE_DIR, "..", "static", "cache")
+INDICE_DIR = os.path.join(CACHE_DIR, "_indices")
+LOCK_DIR   = os.path.join(CACHE_DIR, "_locks")
+
+VERSION_INDICE = 5
+CAMPOS_PRECARGA = ("rendiciones", "placeholders")   # los rellena la precarga, no el índice
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_locks_zip: Dict[str, threading.Lock] = {}   # zip_path → lock entre hilos (el flock es por proceso)
+_memo: Dict[str, tuple] = {}      # zip_path → (tamaño, mtime_ns, mtime_ns del JSON, índice)
+
+
+# ───── helpers ───────────────────────────────────────────────────────────────
+def _ruta_indice(zip_path: str) -> str:
+    return os.path.join(INDICE_DIR, os.path.basename(zip_path) + ".json")
+
+
+def _huella(zip_path: str, zf: zipfile.ZipFile) -> str:
+    """SHA-1 del directorio central + EOCD (nombres, tamaños y CRC de cada miembro)."""
+    h = hashlib.sha1()
+    with open(zip_path, "rb") as fh:
+        fh.seek(zf.start_dir)
+        for bloque in iter(lambda: fh.read(1 << 20), b""):
+            h.update(bloque)
+    return h.hexdigest()
+
+
+def _guardar(ruta: str, indice: Dict) -> None:
+    """Escritura atómica (tmp + rename) para que nadie lea un JSON a medias."""
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(ruta), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as fh:
+            json.dump(indice, fh, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp, ruta)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def _mtime(ruta: str) -> int | None:
+    try:
+        return os.stat(ruta).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _leer(ruta: str) -> Dict | None:
+    try:
+        with open(ruta, encoding="utf-8") as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return None
+
+
+def _vigente(guardado: Dict | None, st: os.stat_result, firma_reglas: str) -> bool:
+    return (
+        guardado is not None
+        and guardado.get("version") == VERSION_INDICE
+        and guardado.get("reglas") == firma_reglas
+        and guardado.get("tamano") == st.st_size
+        and guardado.get("mtime_ns") == st.st_mtime_ns
+    )
+
+
+def _en_memoria(indice: Dict) -> Dict:
+    """Las claves JSON son str; en memoria los capítulos van por int."""
+    return {**indice, "capitulos": {int(c): v for c, v in indice["capitulos"].items()}}
+
+
+@contextmanager
+def _bloqueo(zip_path: str):
+    """Exclusión entre hilos y procesos al reescribir el índice de un ZIP."""
+    with _lock:
+        lock = _locks_zip.setdefault(zip_path, threading.Lock())
+    with lock:
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(LOCK_DIR, exist_ok=True)
+        fd = os.open(os.path.join(LOCK_DIR, f"indice-{os.path.basename(zip_path)}.lock"),
+                     os.O_CREAT | os.O_RDWR, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+
+def _reconstruir(zip_path: str, st: os.stat_result, guardado: Dict | None,
+                 detectar, firma_reglas: str, sondear) -> Dict:
+    """Índice nuevo del ZIP (se llama con el bloqueo tomado)."""
+    valido = (
+        guardado is not None
+        and guardado.get("version") == VERSION_INDICE
+        and guardado.get("reglas") == firma_reglas
+    )
+    with zip_pool_service.abrir(zip_path) as zf:
+        huella = _huella(zip_path, zf)
+        if valido and guardado.get("huella") == huella:
+            # Mismo contenido (copiado / touch): solo se actualiza el stat
+            return {**guardado, "tamano": st.st_size, "mtime_ns": st.st_mtime_ns}
+        logger.info("Reconstruyendo índice de %s", os.path.basename(zip_path))
+        capitulos = detectar(zf)
+        nuevo = {
+            "version":   VERSION_INDICE,
+            "reglas":    firma_reglas,
+            "tamano":    st.st_size,
+            "mtime_ns":  st.st_mtime_ns,
+            "huella":    huella,
+            "capitulos": {str(c): v for c, v in capitulos.items()},
+            "paginas":   {
+                p: sondear(zf, p) for v in capitulos.values() for p in v
+            } if sondear else {},
+        }
+    if guardado and guardado.get("huella") == huella:     # reglas nuevas, mismo ZIP
+        for campo in CAMPOS_PRECARGA:
+            if campo in guardado:
+                nuevo[campo] = guardado[campo]
+    return nuevo
+
+
+# ───── API ───────────────────────────────────────────────────────────────────
+def obtener(zip_path: str,
+            detectar: Callable[[zipfile.ZipFile], Dict[int, List[str]]],
+            firma_reglas: str,
+            sondear: Callable[[zipfile.ZipFile, str], Dict] | None = None) -> Dict:
+    """
+    Índice del ZIP: {"huella", "tamano", "mtime_ns", "capitulos": {int: [rutas]},
+    "paginas": {ruta: cabecera}, ...}.
+    `detectar` es la heurística de capítulos (solicitud_service._detect) y
+    `sondear` lee la cabecera de cada página (conversion_service.sondear).
+    Lanza zipfile.BadZipFile si el archivo no es un ZIP válido.
+    """
+    st = os.stat(zip_path)
+    ruta = _ruta_indice(zip_path)
+    mtime_indice = _mtime(ruta)                # antes de leer: si cambia luego, se relee
+    memo = _memo.get(zip_path)
+    if memo and memo[:3] == (st.st_size, st.st_mtime_ns, mtime_indice):
+        return memo[3]
+
+    guardado = _leer(ruta)
+    if not _vigente(guardado, st, firma_reglas):
+        with _bloqueo(zip_path):
+            guardado = _leer(ruta)             # otro worker pudo reconstruirlo mientras esperábamos
+            if not _vigente(guardado, st, firma_reglas):
+                guardado = _reconstruir(zip_path, st, guardado, detectar, firma_reglas, sondear)
+                _guardar(ruta, guardado)
+            mtime_indice = _mtime(ruta)
+
+    indice = _en_memoria(guardado)
+    with _lock:
+        _memo[zip_path] = (st.st_size, st.st_mtime_ns, mtime_indice, indice)
+    return indice
+
+
+def registrar(zip_path: str, huella: str, campo: str, datos: Dict) -> None:
+    """
+    Añade `datos` al campo `campo` (uno de CAMPOS_PRECARGA) del índice:
+    rendiciones ya generadas (`{"c001/001.w1080.webp": [183412, mtime_ns, "9f3c…"]}`)
+    o BlurHash de páginas (`{"c1/001.png": "LEHV6n…"}`).  Se relee el JSON
+    bajo bloqueo para no pisar lo que otro worker haya añadido; si el ZIP
+    cambió, se descarta.
+    """
+    if not datos:
+        return
+    ruta = _ruta_indice(zip_path)
+    with _bloqueo(zip_path):
+        guardado = _leer(ruta)
+        if guardado is None or guardado.get("huella") != huella:
+            return
+        guardado.setdefault(campo, {}).update(datos)
+        _guardar(ruta, guardado)
+        mtime_indice = _mtime(ruta)
+    with _lock:
+        memo = _memo.get(zip_path)
+        if memo and memo[3]["huella"] == huella:
+            _memo[zip_path] = (memo[0], memo[1], mtime_indice, _en_memoria(guardado))
+
+
+def ruta_cache(indice: Dict, chap: int, filename: str, ext: str = ".jpg",
+               ancho: int | None = None) -> str:
+    """
+    Ruta de la página convertida, indexada por el CONTENIDO del ZIP (huella)
+    y no por id de solicitud / volumen: la revisión del admin, el
+    precalentamiento al aprobar y el lector publicado comparten una caché.
+    Cada ancho de rendición tiene su archivo (`001.w1080.jpg`).
+    """
+    sufijo = f".w{ancho}" if ancho else ""
+    return os.path.join(
+        CACHE_DIR, indice["huella"][:16], f"c{chap:03d}",
+        os.path.splitext(os.path.basename(filename))[0] + sufijo + ext,
+    )
+
+
+def firma(*partes) -> str:
+    """Firma corta de la configuración que influye en el índice (p.ej. las reglas)."""
+    return hashlib.sha1(repr(partes).encode("utf-8")).hexdigest()[:16]
@@ -22,7 +22,7 @@ def publicar_comentario(id_historieta, id_lec, comentario):
 
 def obtener_comentarios(id_historieta):
     try:
-        with db.obtener_conexion() as conexion:
+        with db.obtener_conexion(solo_lectura=True) as conexion:
             with conexion.cursor() as cursor:
                 sql = """
                     SELECT 
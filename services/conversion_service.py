@@ -0,0 +1,383 @@
+# services/conversion_service.py
+"""
+Conversión de páginas ZIP → imagen de la caché, una sola vez por página.
+
+`listar_paginas` lanza el precalentamiento del capítulo y a la vez el lector
+ya está pidiendo esas mismas páginas: sin coordinación la misma imagen se
+decodificaba, redimensionaba y escribía varias veces a la vez.
+
+* Single-flight en proceso: el primer hilo que pide una página la convierte;
+  el resto espera su `Event` y sirve el resultado.
+* Entre procesos (varios workers gunicorn): `flock` sobre un archivo de
+  bloqueo repartido por hash en static/cache/_locks (sin fcntl, p. ej. en
+  Windows, solo se coordina dentro del proceso).
+* Escritura atómica: tmp en la misma carpeta + `os.replace`, así nunca se
+  sirve un JPEG a medias.
+* Motor de procesos: decodificar, LANCZOS y `save(optimize=True)` retienen el
+  GIL, así que la codificación corre en un ProcessPoolExecutor (un proceso
+  por CPU).  Cada proceso tiene un tope de memoria (RLIMIT_AS) y de píxeles,
+  y se recicla tras CONVERSION_TAREAS_HIJO conversiones.  Si el pool se
+  rompe (p. ej. un hijo muerto por OOM) se recrea; CONVERSION_PROCESOS=0
+  convierte en el hilo que llama (útil en hosts sin multiprocessing).
+* Formatos de salida: JPEG siempre; WebP y AVIF si el Pillow instalado
+  sabe codificarlos (AVIF nativo en Pillow ≥ 11.2 o con pillow-avif-plugin).
+* Hojas de miniaturas por capítulo (sprite JPEG + mapa JSON) para el
+  selector de páginas, en el mismo pool.
+* Copia directa: al indexar el ZIP se lee solo la cabecera de cada página
+  (`sondear`).  Las que ya son JPEG RGB/gris dentro de MAX_PX (y del ancho
+  pedido) se copian byte a byte en vez de decodificar y recodificar.
+"""
+from __future__ import annotations
+import hashlib, json, logging, multiprocessing, os, shutil, tempfile, threading, zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+from PIL import Image, features
+
+import services.blurhash_service as blurhash_service
+import services.zip_pool_service as zip_pool_service
+
+try:
+    import pillow_avif  # noqa: F401  (registra AVIF en Pillow < 11.2)
+except ImportError:
+    pillow_avif = None
+
+try:
+    import fcntl
+except ImportError:                      # Windows
+    fcntl = None
+
+BASE_DIR  = os.path.abspath(os.path.dirname(__file__))
+CACHE_DIR = os.path.join(BASE_DIR, "..", "static", "cache")
+LOCK_DIR  = os.path.join(CACHE_DIR, "_locks")
+
+MAX_PX       = 4096
+LOCK_STRIPES = 256
+ESPERA       = float(os.getenv("CONVERSION_ESPERA", 60))   # s máx. esperando a otro hilo
+
+PROCESOS     = int(os.getenv("CONVERSION_PROCESOS", os.cpu_count() or 1))
+TAREAS_HIJO  = int(os.getenv("CONVERSION_TAREAS_HIJO", 200))   # reciclar tras N páginas
+MEMORIA_MB   = int(os.getenv("CONVERSION_MEMORIA_MB", 1024))   # RLIMIT_AS por proceso
+MAX_PIXELES  = int(os.getenv("CONVERSION_MAX_PIXELES", 120_000_000))
+
+MINI_ANCHO, MINI_ALTO = 120, 180         # celda de cada miniatura en la hoja
+MINI_COLUMNAS = 10
+
+# formato → (extensión, mimetype, formato PIL, opciones de save)
+FORMATOS = {
+    "jpeg": (".jpg",  "image/jpeg", "JPEG", {"quality": 85, "optimize": True, "progressive": True}),
+    "webp": (".webp", "image/webp", "WEBP", {"quality": 80, "method": 4}),
+    "avif": (".avif", "image/avif", "AVIF", {"quality": 60, "speed": 6}),
+}
+
+logger = logging.getLogger(__name__)
+
+_lock     = threading.Lock()
+_en_curso: Dict[str, threading.Event] = {}                  # dst → evento del líder
+_stats    = {"hits": 0, "conversiones": 0, "copias_directas": 0, "miniaturas": 0,
+             "esperas": 0, "hechas_por_otro": 0, "errores": 0, "pool_reinicios": 0}
+
+MODOS_DIRECTOS = ("RGB", "L")           # JPEG que cualquier cliente decodifica tal cual
+
+_motor_lock = threading.Lock()
+_motor: ProcessPoolExecutor | None = None
+_motor_pid: int | None = None
+
+
+# ───── motor de procesos ─────────────────────────────────────────────────────
+def _iniciar_hijo(memoria_mb: int, max_pixeles: int) -> None:
+    """Initializer de cada proceso conversor: topes de memoria y de píxeles."""
+    Image.MAX_IMAGE_PIXELS = max_pixeles
+    try:
+        import resource
+        limite = memoria_mb * 1024 * 1024
+        _, duro = resource.getrlimit(resource.RLIMIT_AS)
+        if duro != resource.RLIM_INFINITY:
+            limite = min(limite, duro)
+        resource.setrlimit(resource.RLIMIT_AS, (limite, duro))
+    except (ImportError, ValueError, OSError):
+        pass                                 # Windows o límite no permitido
+
+
+def _obtener_motor() -> ProcessPoolExecutor | None:
+    """Pool perezoso, uno por proceso worker (se recrea tras un fork)."""
+    global _motor, _motor_pid
+    if PROCESOS <= 0:
+        return None
+    with _motor_lock:
+        if _motor is None or _motor_pid != os.getpid():
+            # spawn: hacer fork de un worker con hilos (pool BD, executor) no es seguro
+            _motor = ProcessPoolExecutor(
+                max_workers=PROCESOS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_iniciar_hijo,
+                initargs=(MEMORIA_MB, MAX_PIXELES),
+                max_tasks_per_child=TAREAS_HIJO or None,
+            )
+            _motor_pid = os.getpid()
+        return _motor
+
+
+def _reiniciar_motor(roto: ProcessPoolExecutor) -> None:
+    global _motor
+    with _motor_lock:
+        if _motor is roto:
+            _motor = None
+            _stats["pool_reinicios"] += 1
+    roto.shutdown(wait=False, cancel_futures=True)
+
+
+def _en_motor(fn, *args):
+    """Ejecuta `fn(*args)` en el pool de procesos (o aquí si está desactivado)."""
+    motor = _obtener_motor()
+    if motor is None:
+        return fn(*args)
+    try:
+        return motor.submit(fn, *args).result()
+    except BrokenProcessPool:
+        logger.warning("Pool de conversión roto; se recrea (%s)", fn.__name__)
+        _reiniciar_motor(motor)
+        return _obtener_motor().submit(fn, *args).result()
+
+
+def _ejecutar(zip_path: str, inner: str, dst: str, ancho: int | None = None,
+              formato: str = "jpeg") -> None:
+    _en_motor(_codificar, zip_path, inner, dst, ancho, formato)
+
+
+# ───── helpers ───────────────────────────────────────────────────────────────
+def formatos_disponibles() -> tuple:
+    """Formatos de FORMATOS que este Pillow puede escribir."""
+    Image.init()
+    disponibles = []
+    for nombre, (_, _, pil, _) in FORMATOS.items():
+        if pil == "WEBP" and not features.check("webp"):
+            continue
+        if pil in Image.SAVE:
+            disponibles.append(nombre)
+    return tuple(disponibles)
+
+
+def sondear(zf, inner: str) -> Dict:
+    """
+    Cabecera de una página del ZIP (sin decodificar píxeles) y su tamaño
+    (`bytes`).  Si el miembro está guardado sin comprimir (STORED) se añade
+    dónde empiezan sus bytes dentro del ZIP (`offset`, `crc`) para servirlo
+    sin extraerlo.
+    """
+    try:
+        info = zf.getinfo(inner)
+        with zf.open(inner) as fp:
+            img = Image.open(fp)
+            sonda = {"formato": img.format, "modo": img.mode,
+                     "ancho": img.width, "alto": img.height, "bytes": info.file_size}
+        if info.compress_type == zipfile.ZIP_STORED and not info.flag_bits & 0x1:
+            sonda.update(offset=zip_pool_service.offset_datos(zf.filename, info),
+                         crc=info.CRC)
+        return sonda
+    except Exception:
+        return {"formato": None}
+
+
+def motivo_recodificar(sonda: Optional[Dict], ancho: int | None = None,
+                       formato: str = "jpeg") -> Optional[str]:
+    """None si la página se puede copiar tal cual; si no, el motivo."""
+    if formato != "jpeg":
+        return "formato_salida"
+    if not sonda or not sonda.get("formato"):
+        return "sin_sonda"
+    if sonda["formato"] != "JPEG":
+        return "formato"
+    if sonda["modo"] not in MODOS_DIRECTOS:
+        return "modo"
+    if max(sonda["ancho"], sonda["alto"]) > MAX_PX:
+        return "tamano"
+    if ancho and sonda["ancho"] > ancho:
+        return "ancho"
+    return None
+
+
+def dimensiones(sonda: Optional[Dict], ancho: int | None = None) -> Optional[tuple]:
+    """(ancho, alto) de la página servida en `ancho`, calculado como _codificar."""
+    if not sonda or not sonda.get("formato"):
+        return None
+    w, h = sonda["ancho"], sonda["alto"]
+    if ancho and w > ancho:
+        w, h = ancho, max(1, round(h * ancho / w))
+    if max(w, h) > MAX_PX:
+        f = MAX_PX / max(w, h)
+        w, h = max(1, round(w * f)), max(1, round(h * f))
+    return w, h
+
+
+def _copiar(zip_path: str, inner: str, dst: str) -> None:
+    with zip_pool_service.abrir(zip_path) as zf, zf.open(inner) as fp, open(dst, "wb") as out:
+        shutil.copyfileobj(fp, out, 1 << 20)
+
+
+def _codificar(zip_path: str, inner: str, dst: str, ancho: int | None = None,
+               formato: str = "jpeg") -> None:
+    """Siempre desde el original del ZIP (nunca re-comprimir una rendición)."""
+    with zip_pool_service.abrir(zip_path) as zf, zf.open(inner) as fp:
+        img = Image.open(fp)
+        if ancho and img.width > ancho:
+            if img.mode in ("P", "1"):           # LANCZOS no se aplica a paletas
+                img = img.convert("RGB")
+            alto = max(1, round(img.height * ancho / img.width))
+            img.draft(img.mode, (ancho, alto))   # JPEG: decodifica ya reducido (DCT)
+            img = img.resize((ancho, max(1, round(img.height * ancho / img.width))),
+                             Image.LANCZOS)
+        if max(img.size) > MAX_PX:
+            img.thumbnail((MAX_PX, MAX_PX), Image.LANCZOS)
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        _, _, pil, opciones = FORMATOS[formato]
+        img.save(dst, pil, **opciones)
+
+
+def _sprite(zip_path: str, inners: List[str], dst: str) -> Dict:
+    """
+    Hoja de miniaturas del capítulo (rejilla de MINI_COLUMNAS).  Con JPEG,
+    `draft` decodifica ya escalado 1/2…1/8 (DCT), así que es barato.
+    Devuelve el mapa de posiciones de cada página dentro de la hoja, con el
+    BlurHash de cada miniatura.
+    """
+    cols  = max(1, min(MINI_COLUMNAS, len(inners)))
+    filas = max(1, -(-len(inners) // cols))
+    hoja  = Image.new("RGB", (cols * MINI_ANCHO, filas * MINI_ALTO), "white")
+    mapa  = []
+    with zip_pool_service.abrir(zip_path) as zf:
+        for i, inner in enumerate(inners):
+            x, y = (i % cols) * MINI_ANCHO, (i // cols) * MINI_ALTO
+            try:
+                with zf.open(inner) as fp:
+                    img = Image.open(fp)
+                    img.draft("RGB", (MINI_ANCHO, MINI_ALTO))
+                    img = img.convert("RGB")
+                    img.thumbnail((MINI_ANCHO, MINI_ALTO))
+            except Exception:
+                mapa.append({"pagina": os.path.basename(inner), "x": x, "y": y,
+                             "w": 0, "h": 0, "blurhash": None})
+                continue
+            hoja.paste(img, (x, y))
+            mapa.append({"pagina": os.path.basename(inner), "x": x, "y": y,
+                         "w": img.width, "h": img.height,
+                         "blurhash": blurhash_service.codificar(img)})
+    hoja.save(dst, "JPEG", quality=70, optimize=True)
+    return {"ancho": hoja.width, "alto": hoja.height,
+            "celda": [MINI_ANCHO, MINI_ALTO], "paginas": mapa}
+
+
+def _volcar_json(ruta: str, datos: Dict) -> None:
+    with open(ruta, "w", encoding="utf-8") as fh:
+        json.dump(datos, fh, ensure_ascii=False, separators=(",", ":"))
+
+
+def _escribir_atomico(dst: str, escribir: Callable[[str], None]) -> None:
+    """`escribir(tmp)` y rename a `dst`; el tmp nunca queda a medias en su sitio."""
+    carpeta = os.path.dirname(dst)
+    os.makedirs(carpeta, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=carpeta, prefix=".", suffix=".tmp")
+    os.close(fd)
+    try:
+        escribir(tmp)
+        os.replace(tmp, dst)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+@contextmanager
+def _lock_archivo(dst: str):
+    """Bloqueo exclusivo entre procesos para `dst` (no-op sin fcntl)."""
+    if fcntl is None:
+        yield
+        return
+    franja = int(hashlib.sha1(dst.encode("utf-8")).hexdigest(), 16) % LOCK_STRIPES
+    os.makedirs(LOCK_DIR, exist_ok=True)
+    fd = os.open(os.path.join(LOCK_DIR, f"{franja:03d}.lock"), os.O_CREAT | os.O_RDWR, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+
+def _unico(dst: str, escribir: Callable[[str], None], contador: str) -> str:
+    """Single-flight (hilos + procesos) de la generación atómica de `dst`."""
+    if os.path.isfile(dst):
+        with _lock:
+            _stats["hits"] += 1
+        return dst
+
+    with _lock:
+        evento = _en_curso.get(dst)
+        lider  = evento is None
+        if lider:
+            evento = _en_curso[dst] = threading.Event()
+        else:
+            _stats["esperas"] += 1
+
+    if not lider:
+        evento.wait(ESPERA)
+        if os.path.isfile(dst):
+            return dst
+        # El líder falló o tardó demasiado: se intenta aquí (bajo el lock de archivo)
+
+    try:
+        with _lock_archivo(dst):
+            if os.path.isfile(dst):                   # la hizo otro worker
+                with _lock:
+                    _stats["hechas_por_otro"] += 1
+                return dst
+            _escribir_atomico(dst, escribir)
+            with _lock:
+                _stats[contador] += 1
+        return dst
+    except Exception:
+        with _lock:
+            _stats["errores"] += 1
+        raise
+    finally:
+        if lider:
+            with _lock:
+                _en_curso.pop(dst, None)
+            evento.set()
+
+
+# ───── API ───────────────────────────────────────────────────────────────────
+def asegurar(zip_path: str, inner: str, dst: str, ancho: int | None = None,
+             formato: str = "jpeg", copiar: bool = False) -> str:
+    """
+    Garantiza que `dst` existe (convirtiendo `inner` del ZIP a `formato` si
+    hace falta, reducido a `ancho` px si se indica) y devuelve la ruta.  Si
+    otro hilo o proceso ya la está generando, espera.  Con `copiar` (ver
+    motivo_recodificar) los bytes del ZIP se copian sin recodificar.
+    Propaga las excepciones de PIL / zipfile de la conversión.
+    """
+    if copiar:                                      # E/S pura: no pasa por el pool
+        return _unico(dst, lambda tmp: _copiar(zip_path, inner, tmp), "copias_directas")
+    return _unico(dst, lambda tmp: _ejecutar(zip_path, inner, tmp, ancho, formato),
+                  "conversiones")
+
+
+def asegurar_miniaturas(zip_path: str, inners: List[str], dst_hoja: str, dst_mapa: str) -> str:
+    """
+    Hoja de miniaturas `dst_hoja` + su mapa JSON `dst_mapa`.  El mapa se
+    escribe antes que la hoja: si la hoja existe, el mapa también.
+    """
+    def escribir(tmp):
+        mapa = _en_motor(_sprite, zip_path, inners, tmp)
+        _escribir_atomico(dst_mapa, lambda t: _volcar_json(t, mapa))
+    return _unico(dst_hoja, escribir, "miniaturas")
+
+
+def estadisticas() -> Dict:
+    with _lock:
+        return {**_stats, "en_curso": len(_en_curso), "procesos": PROCESOS}
@@ -0,0 +1,95 @@
+# services/entrega_service.py
+"""
+Entrega de archivos de `static/` (páginas en caché, hojas de miniaturas y
+portadas), en Python o delegada al servidor web de delante.
+
+Con `send_file` el worker WSGI queda ocupado toda la transferencia, y con
+móviles lentos eso son segundos por página.  ENTREGA_MODO:
+
+* `flask`  (por defecto) → send_file, como siempre;
+* `nginx`  → la vista solo resuelve y autoriza la ruta y responde vacía con
+  `X-Accel-Redirect: ENTREGA_PREFIJO/<ruta relativa a static/>`; nginx sirve
+  el archivo desde una `location internal` (ver deploy/nginx.conf.example);
+* `apache` → igual con `X-Sendfile: <ruta absoluta>` (mod_xsendfile).
+
+Las cabeceras de la vista (ETag de contenido, Cache-Control, Vary…) viajan
+en la respuesta vacía; el 304 (`If-None-Match` / `If-Modified-Since`) se
+sigue resolviendo en Python.  Solo se delegan archivos dentro de `static/`.
+"""
+from __future__ import annotations
+import mimetypes, os
+from typing import Optional
+from urllib.parse import quote
+
+from flask import abort, current_app, request, send_file
+from werkzeug.security import safe_join
+
+BASE_DIR   = os.path.abspath(os.path.dirname(__file__))
+STATIC_DIR = os.path.realpath(os.path.join(BASE_DIR, "..", "static"))
+
+MODO    = os.getenv("ENTREGA_MODO", "flask").strip().lower()
+PREFIJO = "/" + os.getenv("ENTREGA_PREFIJO", "/_static_interno/").strip("/") + "/"
+
+if MODO not in ("flask", "nginx", "apache"):
+    raise ValueError(f"ENTREGA_MODO desconocido: {MODO!r} (flask, nginx o apache)")
+
+
+# ───── helpers ───────────────────────────────────────────────────────────────
+def _relativa(ruta: str) -> Optional[str]:
+    """Ruta relativa a static/ (con '/'), o None si está fuera."""
+    real = os.path.realpath(ruta)
+    if os.path.commonpath((real, STATIC_DIR)) != STATIC_DIR:
+        return None
+    return os.path.relpath(real, STATIC_DIR).replace(os.sep, "/")
+
+
+# ───── API ───────────────────────────────────────────────────────────────────
+def delegada() -> bool:
+    return MODO != "flask"
+
+
+def enviar(ruta: str, mimetype: Optional[str] = None, etag: Optional[str] = None,
+           max_age: Optional[int] = None):
+    """
+    Respuesta con el archivo `ruta`.  Lanza FileNotFoundError si no existe
+    (pagina_service lo regenera y reintenta) en todos los modos.
+    """
+    relativa = _relativa(ruta)
+    if MODO == "flask" or relativa is None:
+        return send_file(ruta, mimetype=mimetype, etag=etag if etag else True,
+                         max_age=max_age, conditional=True)
+
+    st = os.stat(ruta)
+    resp = current_app.response_class(
+        mimetype=mimetype or mimetypes.guess_type(ruta)[0] or "application/octet-stream"
+    )
+    if MODO == "nginx":
+        resp.headers["X-Accel-Redirect"] = PREFIJO + quote(relativa)
+    else:
+        resp.headers["X-Sendfile"] = os.path.realpath(ruta)
+    resp.last_modified = st.st_mtime
+    if etag:
+        resp.set_etag(etag)
+    resp.cache_control.no_cache = True                   # como send_file sin max_age
+    if max_age:
+        resp.cache_control.no_cache = None
+        resp.cache_control.public   = True
+        resp.cache_control.max_age  = max_age
+    resp = resp.make_conditional(request.environ)
+    if resp.status_code == 304:           # el servidor web no debe enviar el archivo
+        resp.headers.pop("X-Accel-Redirect", None)
+        resp.headers.pop("X-Sendfile", None)
+    return resp
+
+
+def servir_estatico(filename: str, vista_original):
+    """
+    Vista `static` de Flask con las portadas (`uploads/portadas/…`)
+    delegadas al servidor web; el resto sigue por la vista original.
+    """
+    if not (delegada() and filename.startswith("uploads/portadas/")):
+        return vista_original(filename=filename)
+    ruta = safe_join(current_app.static_folder, filename)
+    if ruta is None or not os.path.isfile(ruta):
+        abort(404)
+    return enviar(ruta, max_age=current_app.get_send_file_max_age(filename))
@@ -2,7 +2,7 @@ import db.database as db
 
 def obtener_generos_por_tipo(tipo_material):
     try:
-        with db.obtener_conexion() as conexion:
+        with db.obtener_conexion(solo_lectura=True) as conexion:
             with conexion.cursor() as cursor:
                 cursor.execute("""
                     SELECT id_genero, nombre_genero
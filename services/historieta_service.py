@@ -27,7 +27,7 @@ def novedades(limit: int = 24):
     """
     Devuelve los volúmenes publicados más recientemente (orden fecha).
     """
-    with db.obtener_conexion() as cn, cn.cursor(DictCursor) as cur:
+    with db.obtener_conexion(solo_lectura=True) as cn, cn.cursor(DictCursor) as cur:
         cur.execute(
             """
             SELECT v.id_volumen, v.titulo_volumen, v.precio_venta,
@@ -47,7 +47,7 @@ def mas_vendidas(limit: int = 24):
     """
     TOP volúmenes por número de ventas (tabla venta_detalle).
     """
-    with db.obtener_conexion() as cn, cn.cursor(DictCursor) as cur:
+    with db.obtener_conexion(solo_lectura=True) as cn, cn.cursor(DictCursor) as cur:
         cur.execute(
             """
             SELECT v.id_volumen, v.titulo_volumen, v.precio_venta,
@@ -92,7 +92,7 @@ def mas_vendidos(limit: int = 10) -> List[Dict]:
     ORDER BY total_vendido DESC
     LIMIT %s;
     """
-    with db.obtener_conexion() as cn, cn.cursor() as cur:
+    with db.obtener_conexion(solo_lectura=True) as cn, cn.cursor() as cur:
         cur.execute(sql, (limit,))
         filas = cur.fetchall()
 
@@ -0,0 +1,119 @@
+# services/identidad_service.py
+"""
+Caché en proceso email → {id_user, id_rol, id_lec} (LRU + TTL).
+
+El email de un usuario casi nunca cambia de dueño, pero se consultaba varias
+veces por petición.  Las escrituras que cambian la fila (registro, alta de
+admin, aprobación de proveedor, altas por login social, alta de lector)
+llaman a `invalidar()`, que borra la entrada ya y otra vez tras el COMMIT real
+de la petición (`db.al_confirmar`).  Una consulta que empezó antes de una
+invalidación no guarda su resultado (contador `_generacion`), y lo leído en una
+petición con escrituras pendientes solo se cachea si llegan a confirmarse.
+La invalidación es local a cada worker: en los demás la entrada caduca como
+mucho a los IDENTIDAD_CACHE_TTL segundos.
+"""
+from __future__ import annotations
+import os, threading, time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from pymysql.cursors import DictCursor
+import db.database as db
+
+MAX_ENTRADAS = int(os.getenv("IDENTIDAD_CACHE_MAX", 10_000))
+TTL          = float(os.getenv("IDENTIDAD_CACHE_TTL", 300))
+
+_lock     = threading.Lock()
+_entradas: "OrderedDict[str, tuple]" = OrderedDict()   # email → (expira, identidad|None)
+_por_id:   Dict[int, str] = {}                          # id_user → email (para invalidar)
+_generacion = 0                                         # sube con cada invalidación
+_stats    = {"hits": 0, "misses": 0, "expiradas": 0, "invalidaciones": 0, "desalojadas": 0}
+
+
+def _cargar(email: str) -> Optional[Dict]:
+    with db.obtener_conexion() as cn, cn.cursor(DictCursor) as cur:
+        cur.execute(
+            """
+            SELECT u.id_user, u.id_rol, l.id_lec
+              FROM usuario u
+              LEFT JOIN lector l ON l.id_user = u.id_user
+             WHERE u.email = %s
+             LIMIT 1
+            """,
+            (email,)
+        )
+        return cur.fetchone()
+
+
+def obtener(email: str) -> Optional[Dict]:
+    """{id_user, id_rol, id_lec} del email, o None si no existe (también se cachea)."""
+    if not email:
+        return None
+    ahora = time.monotonic()
+    with _lock:
+        entrada = _entradas.get(email)
+        if entrada is not None:
+            if entrada[0] > ahora:
+                _entradas.move_to_end(email)
+                _stats["hits"] += 1
+                return entrada[1]
+            _stats["expiradas"] += 1
+        _stats["misses"] += 1
+        generacion = _generacion
+
+    identidad = _cargar(email)
+    db.al_confirmar(lambda: _guardar(email, identidad, ahora + TTL, generacion))
+    return identidad
+
+
+def _guardar(email: str, identidad: Optional[Dict], expira: float, generacion: int) -> None:
+    with _lock:
+        if generacion != _generacion:       # se invalidó mientras se consultaba
+            return
+        _entradas[email] = (expira, identidad)
+        _entradas.move_to_end(email)
+        if identidad:
+            _por_id[identidad["id_user"]] = email
+        while len(_entradas) > MAX_ENTRADAS:
+            viejo, (_, ident) = _entradas.popitem(last=False)
+            if ident:
+                _por_id.pop(ident["id_user"], None)
+            _stats["desalojadas"] += 1
+
+
+def id_user_por_email(email: str) -> Optional[int]:
+    identidad = obtener(email)
+    return identidad["id_user"] if identidad else None
+
+
+def _olvidar(email: str | None, id_user: int | None) -> None:
+    global _generacion
+    with _lock:
+        _generacion += 1
+        if id_user is not None:
+            email = _por_id.pop(int(id_user), None) or email
+        if email is not None:
+            entrada = _entradas.pop(email, None)
+            if entrada and entrada[1]:
+                _por_id.pop(entrada[1]["id_user"], None)
+        _stats["invalidaciones"] += 1
+
+
+def invalidar(email: str | None = None, id_user: int | None = None) -> None:
+    """
+    Olvida la identidad de un email y/o id_user tras modificar su fila.  Se
+    aplica ya (para el resto de la petición) y de nuevo tras el COMMIT real,
+    cuando los demás workers e hilos ya pueden leer la fila nueva.
+    """
+    _olvidar(email, id_user)
+    db.al_confirmar(lambda: _olvidar(email, id_user))
+
+
+def estadisticas() -> Dict:
+    with _lock:
+        total = _stats["hits"] + _stats["misses"]
+        return {
+            **_stats,
+            "entradas": len(_entradas),
+            "ratio_hits": round(_stats["hits"] / total, 3) if total else None,
+        }
@@ -0,0 +1,205 @@
+# services/ingesta_service.py
+"""
+Ingesta en segundo plano de los ZIP subidos por `/upload_zip`.
+
+Antes la subida solo guardaba el archivo y todo lo pesado (detectar
+capítulos, validar imágenes, convertir) ocurría la primera vez que el admin
+abría la solicitud o un lector una página.  Ahora la subida encola un trabajo
+que, en orden:
+
+1. verifica el CRC de todos los miembros (`testzip`);
+2. detecta capítulos, sondea cada imagen (formato, tamaño, corruptas) y
+   construye el índice persistente (catalogo_service);
+3. pre-convierte el primer capítulo en las rendiciones de precarga, con su
+   hoja de miniaturas, BlurHash y tamaños en el índice.
+
+El estado de cada subida se guarda en `static/cache/_ingestas/<zip>.json`
+(lo lee cualquier worker), con el `id_user` de quien subió el ZIP: solo él o
+un admin pueden consultarlo.  `registrar_solicitud` rechaza los ZIP cuya
+ingesta falló.
+"""
+from __future__ import annotations
+import json, logging, os, tempfile, threading, time, zipfile
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+from pymysql.cursors import DictCursor
+
+import db.database as db
+import services.catalogo_service as catalogo_service
+import services.conversion_service as conversion_service
+import services.identidad_service as identidad_service
+import services.pagina_service as pagina_service
+import services.solicitud_service as solicitud_service
+import services.zip_pool_service as zip_pool_service
+from models.Principal import ROL_ADMIN
+
+BASE_DIR    = os.path.abspath(os.path.dirname(__file__))
+UPLOAD_DIR  = solicitud_service.UPLOAD_DIR
+ESTADOS_DIR = os.path.join(BASE_DIR, "..", "static", "cache", "_ingestas")
+
+HILOS = int(os.getenv("INGESTA_HILOS", 1))
+
+logger = logging.getLogger(__name__)
+
+_lock   = threading.Lock()
+_motor: Optional[ThreadPoolExecutor] = None
+_pid    = None
+
+
+# ───── helpers ───────────────────────────────────────────────────────────────
+def _ruta_estado(filename: str) -> str:
+    return os.path.join(ESTADOS_DIR, os.path.basename(filename) + ".json")
+
+
+def _guardar(filename: str, **cambios) -> Dict:
+    """Actualiza el estado de la subida (escritura atómica) y lo devuelve."""
+    estado = {**(leer(filename) or {}), **cambios, "actualizado": time.time()}
+    os.makedirs(ESTADOS_DIR, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=ESTADOS_DIR, suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as fh:
+        json.dump(estado, fh, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp, _ruta_estado(filename))
+    return estado
+
+
+def _obtener_motor() -> ThreadPoolExecutor:
+    global _motor, _pid
+    with _lock:
+        if _motor is None or _pid != os.getpid():
+            _motor = ThreadPoolExecutor(max_workers=HILOS, thread_name_prefix="ingesta")
+            _pid = os.getpid()
+        return _motor
+
+
+def _fallar(filename: str, motivo: str, **datos) -> None:
+    logger.warning("Ingesta de %s rechazada: %s", filename, motivo)
+    _guardar(filename, estado="fallida", etapa=None, error=motivo, **datos)
+
+
+def _de_sus_solicitudes(filename: str, id_user: int) -> bool:
+    """¿Tiene `id_user` una solicitud con este ZIP? (subidas sin id_user en el estado)."""
+    patron = "%" + filename.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    with db.obtener_conexion(solo_lectura=True) as cn, cn.cursor(DictCursor) as cur:
+        cur.execute(
+            "SELECT url_zip FROM solicitud_publicacion WHERE id_user = %s AND url_zip LIKE %s",
+            (id_user, patron)
+        )
+        filas = cur.fetchall()
+    return any(os.path.basename(f["url_zip"].split("?")[0].rstrip("/")) == filename for f in filas)
+
+
+def _autorizado(filename: str, datos: Dict, principal) -> bool:
+    """Quien subió el ZIP o un admin (rol vigente, no el del token)."""
+    dueno = datos.get("id_user")
+    if dueno is not None and dueno == principal.id_user:
+        return True
+    if dueno is None and _de_sus_solicitudes(filename, principal.id_user):
+        return True
+    vigente = identidad_service.obtener(principal.email)
+    return bool(vigente) and vigente["id_rol"] == ROL_ADMIN
+
+
+def _ingerir(filename: str) -> None:
+    zip_path = os.path.join(UPLOAD_DIR, filename)
+    t0 = time.perf_counter()
+    try:
+        # 1) CRC de todos los miembros
+        _guardar(filename, estado="procesando", etapa="crc")
+        try:
+            with zip_pool_service.abrir(zip_path) as zf:
+                malo = zf.testzip()
+        except zipfile.BadZipFile as exc:
+            return _fallar(filename, f"No es un ZIP válido: {exc}")
+        if malo is not None:
+            return _fallar(filename, f"CRC incorrecto en {malo}")
+
+        # 2) Capítulos + sondeo de cada imagen → índice persistente
+        _guardar(filename, etapa="indice")
+        indice = catalogo_service.obtener(
+            zip_path, solicitud_service._detect, solicitud_service._FIRMA_REGLAS,
+            conversion_service.sondear,
+        )
+        capitulos = indice["capitulos"]
+        sondas = indice.get("paginas", {})
+        corruptas = sorted(p for p, s in sondas.items() if not s.get("formato"))
+        resumen = {
+            "capitulos": len(capitulos),
+            "paginas":   sum(len(v) for v in capitulos.values()),
+            "formatos":  dict(Counter(s["formato"] for s in sondas.values() if s.get("formato"))),
+            "corruptas": corruptas[:50],
+        }
+        if not capitulos:
+            return _fallar(filename, "No se detectaron capítulos", resumen=resumen)
+        if corruptas:
+            return _fallar(filename, f"{len(corruptas)} imágenes ilegibles", resumen=resumen)
+
+        # 3) Primer capítulo listo para la revisión y la primera lectura
+        _guardar(filename, etapa="primer_capitulo", resumen=resumen)
+        chap = min(capitulos)
+        for p in pagina_service.paginas_precarga(zip_path, indice, chap, capitulos[chap],
+                                                 pagina_service.PRECARGA,
+                                                 pagina_service.FORMATOS_PRECARGA):
+            conversion_service.asegurar(*p)
+        tareas = [pagina_service.tarea_miniaturas(zip_path, indice, chap)] + [
+            pagina_service.tarea_medidas(zip_path, indice, chap, capitulos[chap], a, f)
+            for a in pagina_service.PRECARGA for f in pagina_service.FORMATOS_PRECARGA
+        ]
+        for tarea in tareas:
+            if tarea is not None:
+                _, fn, args = tarea
+                fn(*args)
+
+        _guardar(filename, estado="lista", etapa=None, huella=indice["huella"][:16],
+                 duracion_s=round(time.perf_counter() - t0, 1))
+        logger.info("Ingesta de %s lista en %.1f s", filename, time.perf_counter() - t0)
+    except Exception as exc:
+        logger.exception("Ingesta de %s falló", filename)
+        _fallar(filename, f"Error interno: {exc.__class__.__name__}")
+
+
+# ───── API ───────────────────────────────────────────────────────────────────
+def encolar(filename: str, id_user: Optional[int] = None) -> Dict:
+    """
+    Encola la ingesta del ZIP recién subido (`filename` dentro de UPLOAD_DIR)
+    por `id_user`.
+    """
+    filename = os.path.basename(filename)
+    estado = _guardar(filename, estado="en_cola", etapa=None, error=None,
+                      resumen=None, encolado=time.time(), id_user=id_user)
+    _obtener_motor().submit(_ingerir, filename)
+    return estado
+
+
+def leer(filename: str) -> Optional[Dict]:
+    try:
+        with open(_ruta_estado(filename), encoding="utf-8") as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return None
+
+
+def estado(filename: str, principal):
+    """
+    Estado de la ingesta de una subida: en_cola, procesando, lista o fallida.
+    Solo para quien la subió o un admin.
+    """
+    datos = leer(filename)
+    if datos is None:
+        return {"code": 1, "msg": "Subida no encontrada"}, 404
+    if not _autorizado(os.path.basename(filename), datos, principal):
+        return {"code": 1, "msg": "No autorizado"}, 403
+    return {"code": 0, "archivo": os.path.basename(filename), **datos}, 200
+
+
+def rechazo(url_zip: str) -> Optional[str]:
+    """
+    Motivo por el que no se puede registrar una solicitud con este ZIP (su
+    ingesta falló), o None.  Subidas sin estado (anteriores a la ingesta) o
+    aún en curso se aceptan.
+    """
+    datos = leer(os.path.basename(url_zip.split("?")[0].rstrip("/")))
+    if datos and datos.get("estado") == "fallida":
+        return datos.get("error") or "La verificación del ZIP falló"
+    return None
@@ -1,4 +1,5 @@
 import db.database as db
+import services.identidad_service as identidad_service
 
 def obtener_lector_id(dni):
     try:
@@ -19,6 +20,7 @@ def registrar_lector(dni_lec, nom_lec, apellidos_lec, fecha_nac, id_user):
             cursor.execute("INSERT INTO lector (dni_lec, nom_lec, apellidos_lec, fecha_nac, id_user) VALUES (%s, %s, %s, %s, %s)",
                             (dni_lec, nom_lec, apellidos_lec, fecha_nac, id_user))
         conexion.commit()
+        identidad_service.invalidar(id_user=id_user)
     except Exception as e:
         print("Error: ", e)
         return None
\ No newline at end of file
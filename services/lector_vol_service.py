@@ -1,28 +1,28 @@
 # services/lector_vol_service.py
 from __future__ import annotations
-import os, io, zipfile
+import os
 from functools   import lru_cache
-from contextlib  import contextmanager
-from typing      import List, Dict
+from typing      import List, Dict, Union
 from pymysql.cursors import DictCursor
-from flask  import abort, url_for, send_file, current_app
-from PIL    import Image
+from flask  import abort, url_for
 import db.database as db
+import services.identidad_service as identidad_service
 
 # ───────── config reutilizada ─────────
 BASE_DIR  = os.path.abspath(os.path.dirname(__file__))
 UPLOAD_ZIPS = os.path.join(BASE_DIR, "..", "static", "uploads", "zips")
 from services.solicitud_service import (          # ← ¡YA EXISTEN!
-    _load_rules, _numeric_tokens, _split_reset,
-    _is_img, _detect, MAX_PX, CACHE_DIR,          # mismas constantes
+    _load_rules, _indice, precargar_capitulo,
 )
+import services.pagina_service as pagina_service
+import services.paquete_service as paquete_service
 
 RULES = _load_rules()                             # mismas expresiones
 
 # ───────── helpers específicos de volumen ──────
 @lru_cache(maxsize=512)
 def _zip_path_vol(id_vol:int) -> str:
-    with db.obtener_conexion() as cn, cn.cursor(DictCursor) as cur:
+    with db.obtener_conexion(solo_lectura=True) as cn, cn.cursor(DictCursor) as cur:
         cur.execute("SELECT ruta_contenido FROM volumen WHERE id_volumen=%s", (id_vol,))
         row = cur.fetchone()
     if not row: abort(404, "Volumen no encontrado")
@@ -31,25 +31,14 @@ def _zip_path_vol(id_vol:int) -> str:
     return path
 
 
-@contextmanager
-def _zip_open(id_vol:int):
-    try:
-        with zipfile.ZipFile(_zip_path_vol(id_vol), "r") as zf:
-            yield zf
-    except zipfile.BadZipFile:
-        abort(500, "ZIP corrupto")
-
-
-@lru_cache(maxsize=256)
 def _catalogo(id_vol:int) -> Dict[int, List[str]]:
-    with _zip_open(id_vol) as zf:
-        return _detect(zf)                         # ¡misma heurística!
+    return _indice(_zip_path_vol(id_vol))["capitulos"]   # ¡mismo índice persistente!
 
 
 # ───────── endpoints “lógicos” (llamados desde main.py) ────────
 def ficha_volumen(id_vol:int):
     """Datos para la pantalla de detalles (sinopsis, precio, etc.)."""
-    with db.obtener_conexion() as cn, cn.cursor(DictCursor) as cur:
+    with db.obtener_conexion(solo_lectura=True) as cn, cn.cursor(DictCursor) as cur:
         cur.execute("""
             SELECT v.id_volumen, v.titulo_volumen     AS titulo,
                    h.descripcion                      AS sinopsis,
@@ -72,7 +61,7 @@ def listar_capitulos(id_vol: int):
     caps = [f"c{c:03d}" for c in sorted(_catalogo(id_vol))]
 
     # 2) Obtener el 'tipo' de historieta desde la BD
-    with db.obtener_conexion() as cn, cn.cursor(DictCursor) as cursor:
+    with db.obtener_conexion(solo_lectura=True) as cn, cn.cursor(DictCursor) as cursor:
         cursor.execute("""
             SELECT h.tipo
               FROM volumen v
@@ -97,48 +86,83 @@ def listar_paginas(id_vol:int, chap:str):
     cat = _catalogo(id_vol)
     if c not in cat:
         return {"code":1,"msg":"Capítulo no encontrado"},404
+    ancho = pagina_service.ancho_pedido()
+    indice = _indice(_zip_path_vol(id_vol))
     pages = [url_for("srv_vol_page", id=id_vol, chapter=chap,
-                     filename=os.path.basename(p), _external=True)
+                     filename=os.path.basename(p), w=ancho,
+                     v=indice["huella"][:16], _external=True)
              for p in cat[c]]
-    return {"code":0,"pages":pages}, 200
-
-
-# conversión + caché idéntica a solicitud_service -----------------
-def _cache_path(id_vol:int, chap:int, fname:str):
-    base = os.path.splitext(fname)[0]+".jpg"
-    return os.path.join(CACHE_DIR, f"v{id_vol}", f"c{chap:03d}", base)
+    medidas = pagina_service.manifiesto(indice, c, ancho, pagina_service.formato_pedido())
+    precargar_capitulo(_zip_path_vol(id_vol), c, cat[c], ancho)
+    return {"code":0,"pages":pages,
+            "paginas":[{"url":u, **m} for u, m in zip(pages, medidas)],
+            "anchos":list(pagina_service.ANCHOS)}, 200
 
 
 def serve_page(id_vol:int, chapter:str, filename:str):   # ← registrado en main.py
     chap=int(chapter.lstrip("c"))
-    dst=_cache_path(id_vol,chap,filename)
-    if os.path.isfile(dst):
-        return send_file(dst, mimetype="image/jpeg", max_age=31536000)
+    zip_path=_zip_path_vol(id_vol)
+    return pagina_service.servir(zip_path, _indice(zip_path), chap, filename)
 
-    cat=_catalogo(id_vol)
-    target=[p for p in cat.get(chap,[]) if p.endswith(filename)]
-    if not target: abort(404)
 
-    with _zip_open(id_vol) as zf:
-        img=Image.open(io.BytesIO(zf.read(target[0])))
+def miniaturas(id_vol:int, chap:str):
+    """Mapa de la hoja de miniaturas del capítulo (para el selector de páginas)."""
+    c = int(chap.lstrip("c"))
+    zip_path = _zip_path_vol(id_vol)
+    indice = _indice(zip_path)
+    if c not in indice["capitulos"]:
+        return {"code":1,"msg":"Capítulo no encontrado"},404
+    mapa = pagina_service.mapa_miniaturas(zip_path, indice, c)
+    sprite = url_for("api_thumbs_sprite", id_vol=id_vol, chapter=chap,
+                     v=indice["huella"][:16], _external=True)
+    return {"code":0, "sprite":sprite, **mapa}, 200
 
-    if max(img.size)>MAX_PX: img.thumbnail((MAX_PX,MAX_PX), Image.LANCZOS)
-    if img.mode!="RGB": img=img.convert("RGB")
 
-    os.makedirs(os.path.dirname(dst), exist_ok=True)
-    img.save(dst,"JPEG",quality=85,optimize=True,progressive=True)
-    return send_file(dst,mimetype="image/jpeg",max_age=31536000)
+def miniaturas_hoja(id_vol:int, chap:str):
+    c = int(chap.lstrip("c"))
+    zip_path = _zip_path_vol(id_vol)
+    indice = _indice(zip_path)
+    if c not in indice["capitulos"]: abort(404)
+    return pagina_service.servir_miniaturas(zip_path, indice, c)
 
 
-def usuario_compro_volumen(email_user: str, id_vol: int) -> bool:
-    with db.obtener_conexion() as cn, cn.cursor(DictCursor) as cursor:
-        # 1) Obtener id_user
-        cursor.execute("SELECT id_user FROM usuario WHERE email = %s", (email_user,))
-        fila = cursor.fetchone()
-        if not fila:
-            return False
-        id_user = fila["id_user"]
+def numero_capitulo(chap:str) -> int | None:
+    """"c012" / "12" → 12; None si no es un número de capítulo."""
+    num = chap.lstrip("c")
+    return int(num) if num.isascii() and num.isdigit() else None
 
+
+def primer_capitulo(id_vol:int) -> int | None:
+    """Capítulo de muestra (el único accesible sin comprar el volumen); None si no hay."""
+    return min(_catalogo(id_vol), default=None)
+
+
+def paquete(id_vol:int, chap:str | None = None):
+    """TAR del capítulo `chap` (o del volumen entero) para lectura offline."""
+    zip_path = _zip_path_vol(id_vol)
+    indice = _indice(zip_path)
+    if chap is None:
+        return paquete_service.servir(zip_path, indice, sorted(indice["capitulos"]),
+                                      f"volumen-{id_vol}")
+    c = numero_capitulo(chap)
+    if c not in indice["capitulos"]: abort(404)
+    return paquete_service.servir(zip_path, indice, [c], f"volumen-{id_vol}-c{c:03d}")
+
+
+def informe_paginas(id_vol:int):
+    """Páginas del volumen que se sirven por copia directa vs. recodificadas."""
+    return {"code":0, "id_volumen":id_vol,
+            **pagina_service.informe(_indice(_zip_path_vol(id_vol)))}, 200
+
+
+def usuario_compro_volumen(user: Union[int, str], id_vol: int) -> bool:
+    """'user' puede ser el id_user (claims del JWT) o, por compatibilidad, el email."""
+    # 1) Obtener id_user
+    id_user = user if isinstance(user, int) else identidad_service.id_user_por_email(user)
+    if id_user is None:
+        return False
+
+    with db.obtener_conexion() as cn, cn.cursor(DictCursor) as cursor:
         # 2) Verificar compra por volumen (solo ventas activas, no devueltas)
         cursor.execute(
             """
@@ -0,0 +1,468 @@
+# services/pagina_service.py
+"""
+Entrega de páginas de capítulo (solicitudes y volúmenes publicados).
+
+Rendiciones por ancho: el móvil pide `?w=1080` (opcionalmente `&dpr=2.75`
+con `w` en px CSS) o manda las client hints `Width` / `Viewport-Width` + `DPR`.
+El ancho se ajusta hacia arriba al más cercano de RENDICIONES_ANCHOS y cada
+ancho tiene su propio archivo en caché; sin ancho (o mayor que el máximo) se
+sirve el original limitado a MAX_PX.
+
+Formato por negociación de `Accept`: WebP (o AVIF, si se activa) si el
+cliente lo acepta y está en FORMATOS_SERVIDOS (y el Pillow del servidor lo
+codifica); si no, JPEG.  Un archivo de caché por formato y `Vary: Accept`.
+AVIF es opcional: codificarlo cuesta segundos por página, así que solo
+conviene servirlo si también está en FORMATOS_PRECARGA.
+
+El manifiesto del capítulo (`manifiesto`) da ancho, alto, bytes y BlurHash
+de cada página en la rendición pedida sin abrir el ZIP: las dimensiones
+salen de la cabecera sondeada en el índice, los bytes del propio miembro
+(copias) o de lo que la precarga registra en el índice tras generar cada
+archivo, y el BlurHash de la miniatura de la hoja del capítulo.
+
+Validadores: ETag fuerte con el hash del contenido de cada rendición
+(registrado en el índice al precalentar, o calculado una vez por proceso),
+así que regenerar la caché no invalida lo que el cliente ya tiene.  Un
+`If-None-Match` que coincide se contesta 304 con un `stat` y sin abrir la
+imagen; `Range` / `If-Range` funcionan sobre el mismo ETag.  Las URLs
+versionadas (`?v=<huella>`, como las del manifiesto) van con `immutable`.
+
+Con ENTREGA_MODO=nginx / apache las páginas de la caché y las hojas de
+miniaturas no se envían desde Python: ver entrega_service.
+
+Páginas que se pueden servir tal cual y están guardadas sin comprimir
+(STORED) en el ZIP no pasan por la caché: se sirven directamente desde el
+archivo con el offset guardado en el índice, con soporte de Range.  Bajo
+gunicorn la respuesta completa sale por `os.sendfile` (wsgi.file_wrapper).
+"""
+from __future__ import annotations
+import hashlib, io, json, logging, os, threading
+from collections import Counter, OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from flask import abort, current_app, request
+from werkzeug.wsgi import wrap_file
+
+import services.cache_service as cache_service
+import services.catalogo_service as catalogo_service
+import services.conversion_service as conversion_service
+import services.entrega_service as entrega_service
+import services.precarga_service as precarga_service
+
+
+def _anchos(valor: str) -> Tuple[Optional[int], ...]:
+    """'original,1080' → (None, 1080)."""
+    return tuple(
+        None if a.strip() in ("original", "0") else int(a)
+        for a in valor.split(",") if a.strip()
+    )
+
+
+def _formatos(valor: str) -> Tuple[str, ...]:
+    disponibles = conversion_service.formatos_disponibles()
+    return tuple(f for f in (x.strip().lower() for x in valor.split(",")) if f in disponibles)
+
+
+ANCHOS    = tuple(sorted(a for a in _anchos(os.getenv("RENDICIONES_ANCHOS", "720,1080,1440")) if a))
+PRECARGA  = _anchos(os.getenv("RENDICIONES_PRECARGA", "original,1080"))   # al aprobar
+# En orden de preferencia; JPEG es siempre el último recurso.  AVIF no va por
+# defecto (ver bench_formatos): se activa en los dos, SERVIDOS y PRECARGA
+SERVIDOS  = _formatos(os.getenv("FORMATOS_SERVIDOS", "webp,jpeg"))
+FORMATOS_PRECARGA = _formatos(os.getenv("FORMATOS_PRECARGA", "webp,jpeg")) or ("jpeg",)
+MAX_AGE   = 31536000
+HINTS     = ("Width", "Viewport-Width", "DPR")
+ETAGS_MAX = int(os.getenv("PAGINAS_ETAGS_MAX", 50000))   # hashes recordados por proceso
+
+logger = logging.getLogger(__name__)
+
+if set(SERVIDOS) - set(FORMATOS_PRECARGA) - {"jpeg"}:
+    logger.warning("FORMATOS_SERVIDOS incluye %s sin precarga: se codificarán bajo demanda",
+                   ", ".join(sorted(set(SERVIDOS) - set(FORMATOS_PRECARGA) - {"jpeg"})))
+
+_lock_etags = threading.Lock()
+_etags: "OrderedDict[str, tuple]" = OrderedDict()     # ruta → ((bytes, mtime_ns), hash)
+
+
+# ───── helpers ───────────────────────────────────────────────────────────────
+def _ajustar(px: float) -> Optional[int]:
+    if px <= 0:
+        return None
+    return next((a for a in ANCHOS if px <= a), None)
+
+
+def ancho_pedido() -> Optional[int]:
+    """Ancho de rendición de la petición (parámetros o client hints), o None."""
+    args, h = request.args, request.headers
+    try:
+        if "w" in args:
+            return _ajustar(float(args["w"]) * float(args.get("dpr", 1)))
+        if "Width" in h:
+            return _ajustar(float(h["Width"]))
+        if "Viewport-Width" in h:
+            return _ajustar(float(h["Viewport-Width"]) * float(h.get("DPR", 1)))
+    except ValueError:
+        pass
+    return None
+
+
+def _calidad(params: str) -> float:
+    for p in params.split(";"):
+        clave, _, valor = p.strip().partition("=")
+        if clave.strip() == "q":
+            try:
+                return float(valor)
+            except ValueError:
+                return 0.0
+    return 1.0
+
+
+def formato_pedido() -> str:
+    """Mejor formato de SERVIDOS que acepta la petición (Accept), o 'jpeg'."""
+    aceptados = set()
+    for parte in request.headers.get("Accept", "").split(","):
+        tipo, _, params = parte.strip().partition(";")
+        if _calidad(params) > 0:                       # q=0 → rechazado
+            aceptados.add(tipo.strip().lower())
+    for formato in SERVIDOS:
+        if conversion_service.FORMATOS[formato][1] in aceptados:
+            return formato
+    return "jpeg"
+
+
+def _ruta(indice: Dict, chap: int, filename: str, ancho: Optional[int], formato: str) -> str:
+    ext = conversion_service.FORMATOS[formato][0]
+    return catalogo_service.ruta_cache(indice, chap, filename, ext=ext, ancho=ancho)
+
+
+def _copiar(indice: Dict, inner: str, ancho: Optional[int], formato: str) -> bool:
+    sonda = indice.get("paginas", {}).get(inner)
+    return conversion_service.motivo_recodificar(sonda, ancho, formato) is None
+
+
+def _desde_zip(indice: Dict, inner: str, ancho: Optional[int], formato: str) -> Optional[Dict]:
+    """Sonda del miembro si se sirve directamente del ZIP (STORED y sin recodificar)."""
+    sonda = indice.get("paginas", {}).get(inner)
+    if sonda and sonda.get("offset") is not None and _copiar(indice, inner, ancho, formato):
+        return sonda
+    return None
+
+
+def _versionada(indice: Dict) -> bool:
+    return request.args.get("v") == indice["huella"][:16]
+
+
+def _cachear(resp, indice: Dict):
+    resp.cache_control.public  = True
+    resp.cache_control.max_age = MAX_AGE
+    if _versionada(indice):
+        resp.cache_control.immutable = True
+    return resp
+
+
+def _no_modificado(indice: Dict, etag: Optional[str]):
+    """304 si el cliente ya tiene `etag` (sin abrir nada), si no None."""
+    if etag is None or not request.if_none_match.contains_weak(etag):
+        return None
+    resp = current_app.response_class(status=304)
+    resp.set_etag(etag)
+    return _cachear(resp, indice)
+
+
+class _Ventana(io.RawIOBase):
+    """Archivo de solo lectura limitado a [inicio, inicio+longitud) de otro archivo."""
+
+    def __init__(self, ruta: str, inicio: int, longitud: int):
+        self._f = open(ruta, "rb", buffering=0)
+        self._inicio, self._longitud, self._pos = inicio, longitud, 0
+        self._f.seek(inicio)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def fileno(self):
+        # La posición real del descriptor siempre es inicio + pos: sendfile
+        # parte de ahí y envía Content-Length bytes.
+        return self._f.fileno()
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, pos, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: self._longitud}[whence]
+        self._pos = max(0, min(self._longitud, base + pos))
+        self._f.seek(self._inicio + self._pos)
+        return self._pos
+
+    def readinto(self, b):
+        n = min(len(b), self._longitud - self._pos)
+        if n <= 0:
+            return 0
+        leidos = self._f.readinto(memoryview(b)[:n])
+        self._pos += leidos
+        return leidos
+
+    def close(self):
+        if not self.closed:
+            self._f.close()
+        super().close()
+
+
+def _servir_desde_zip(zip_path: str, indice: Dict, sonda: Dict):
+    etag = f"{indice['huella'][:16]}-{sonda['crc']:08x}"
+    resp = _no_modificado(indice, etag)
+    if resp is not None:
+        return resp
+    ventana = _Ventana(zip_path, sonda["offset"], sonda["bytes"])
+    resp = current_app.response_class(
+        wrap_file(request.environ, ventana), mimetype="image/jpeg", direct_passthrough=True
+    )
+    resp.content_length = sonda["bytes"]
+    resp.last_modified  = indice["mtime_ns"] / 1e9
+    resp.set_etag(etag)
+    _cachear(resp, indice)
+    return resp.make_conditional(request.environ, accept_ranges=True,
+                                 complete_length=sonda["bytes"])
+
+
+def paginas_precarga(zip_path: str, indice: Dict, chap: int, inners: List[str],
+                     anchos=(None,), formatos=("jpeg",)) -> List[tuple]:
+    """
+    Trabajos (zip, interna, destino, ancho, formato, copiar) en orden de lectura.
+    Las páginas que se sirven directamente del ZIP no necesitan precarga.
+    """
+    return [
+        (zip_path, p, _ruta(indice, chap, p, a, f), a, f, _copiar(indice, p, a, f))
+        for p in inners for a in anchos for f in formatos
+        if _desde_zip(indice, p, a, f) is None
+    ]
+
+
+def _clave_rendicion(dst: str) -> str:
+    """'…/<huella>/c001/001.w1080.webp' → 'c001/001.w1080.webp' (clave en indice["rendiciones"])."""
+    return "/".join(dst.split(os.sep)[-2:])
+
+
+def _hash_archivo(ruta: str) -> str:
+    h = hashlib.sha256()
+    with open(ruta, "rb") as fh:
+        for bloque in iter(lambda: fh.read(1 << 20), b""):
+            h.update(bloque)
+    return h.hexdigest()[:32]
+
+
+def _firma(ruta: str) -> list:
+    """[bytes, mtime_ns, hash del contenido] del archivo de la caché."""
+    st = os.stat(ruta)
+    return [st.st_size, st.st_mtime_ns, _hash_archivo(ruta)]
+
+
+def _etag(indice: Dict, dst: str) -> Optional[str]:
+    """
+    Hash del contenido de `dst` (None si no existe).  Con un `stat` basta si
+    ya se conoce: memoria del proceso o índice, validados por tamaño y mtime.
+    """
+    try:
+        st = os.stat(dst)
+    except FileNotFoundError:
+        return None
+    firma = (st.st_size, st.st_mtime_ns)
+    with _lock_etags:
+        e = _etags.get(dst)
+        if e is not None and e[0] == firma:
+            _etags.move_to_end(dst)
+            return e[1]
+    guardada = indice.get("rendiciones", {}).get(_clave_rendicion(dst))
+    if guardada and tuple(guardada[:2]) == firma:
+        etag = guardada[2]
+    else:
+        etag = _hash_archivo(dst)                 # regenerada o aún sin registrar
+    with _lock_etags:
+        _etags[dst] = (firma, etag)
+        _etags.move_to_end(dst)
+        while len(_etags) > ETAGS_MAX:
+            _etags.popitem(last=False)
+    return etag
+
+
+def _medir(zip_path: str, huella: str, paginas: List[tuple]) -> None:
+    """Genera (o espera) cada rendición y apunta su tamaño y hash en el índice."""
+    rendiciones = {}
+    for p in paginas:
+        try:
+            conversion_service.asegurar(*p)
+            rendiciones[_clave_rendicion(p[2])] = _firma(p[2])
+        except Exception:
+            logger.debug("Sin firma para %s", p[2], exc_info=True)
+    catalogo_service.registrar(zip_path, huella, "rendiciones", rendiciones)
+
+
+def tarea_medidas(zip_path: str, indice: Dict, chap: int, inners: List[str],
+                  ancho: Optional[int], formato: str) -> Optional[Tuple]:
+    """
+    Trabajo de precarga_service que registra tamaño y hash de las rendiciones
+    del capítulo (None si ya se conocen todas).  Se encola detrás de las
+    páginas, así que normalmente solo las encuentra hechas.
+    """
+    conocidos = indice.get("rendiciones", {})
+    pendientes = [
+        p for p in paginas_precarga(zip_path, indice, chap, inners, (ancho,), (formato,))
+        if _clave_rendicion(p[2]) not in conocidos
+    ]
+    if not pendientes:
+        return None
+    clave = _ruta(indice, chap, "_medidas", ancho, formato)
+    return (clave, _medir, (zip_path, indice["huella"], pendientes))
+
+
+def manifiesto(indice: Dict, chap: int, ancho: Optional[int], formato: str) -> List[Dict]:
+    """
+    [{ancho, alto, bytes, blurhash}] de cada página del capítulo tal como se
+    servirá (None si aún no se sabe).
+    """
+    res = []
+    for p in indice["capitulos"][chap]:
+        sonda = indice.get("paginas", {}).get(p)
+        dims = conversion_service.dimensiones(sonda, ancho) or (None, None)
+        if _copiar(indice, p, ancho, formato):
+            tamano = sonda.get("bytes")
+        else:
+            firma = indice.get("rendiciones", {}).get(
+                _clave_rendicion(_ruta(indice, chap, p, ancho, formato)))
+            tamano = firma[0] if firma else None
+        res.append({"ancho": dims[0], "alto": dims[1], "bytes": tamano,
+                    "blurhash": indice.get("placeholders", {}).get(p)})
+    return res
+
+
+def _rutas_miniaturas(indice: Dict, chap: int) -> Tuple[str, str]:
+    """Hoja y mapa junto a las páginas del capítulo en la caché."""
+    return (catalogo_service.ruta_cache(indice, chap, "_miniaturas", ext=".jpg"),
+            catalogo_service.ruta_cache(indice, chap, "_miniaturas", ext=".json"))
+
+
+def _miniaturas_al_indice(zip_path: str, huella: str, inners: List[str],
+                          hoja: str, mapa: str) -> None:
+    """Genera la hoja si falta y pasa los BlurHash de su mapa al índice."""
+    conversion_service.asegurar_miniaturas(zip_path, inners, hoja, mapa)
+    paginas = _leer_mapa(mapa)["paginas"]
+    if any("blurhash" not in m for m in paginas):          # hoja anterior a los BlurHash
+        os.unlink(hoja)
+        conversion_service.asegurar_miniaturas(zip_path, inners, hoja, mapa)
+        paginas = _leer_mapa(mapa)["paginas"]
+    catalogo_service.registrar(zip_path, huella, "placeholders",
+                               {p: m["blurhash"] for p, m in zip(inners, paginas)})
+
+
+def tarea_miniaturas(zip_path: str, indice: Dict, chap: int) -> Tuple:
+    """
+    Trabajo de precarga_service que genera la hoja de miniaturas del capítulo
+    y, si el índice aún no los tiene, guarda ahí los BlurHash de sus páginas.
+    """
+    hoja, mapa = _rutas_miniaturas(indice, chap)
+    inners = indice["capitulos"][chap]
+    conocidos = indice.get("placeholders", {})
+    if all(p in conocidos for p in inners):
+        return (hoja, conversion_service.asegurar_miniaturas, (zip_path, inners, hoja, mapa))
+    # Clave que no es un archivo: la precarga no la salta aunque la hoja ya exista
+    return (mapa + ".indice", _miniaturas_al_indice,
+            (zip_path, indice["huella"], inners, hoja, mapa))
+
+
+def _con_reintento(ruta: str, generar, usar):
+    """
+    Genera `ruta` si falta y la usa.  Si el gestor de caché la desaloja justo
+    entre medias (FileNotFoundError), se regenera una vez.
+    """
+    existe = os.path.isfile(ruta)
+    cache_service.tocar(ruta, existe)
+    if not existe:
+        generar()
+    try:
+        return usar()
+    except FileNotFoundError:
+        generar()
+        return usar()
+
+
+def _leer_mapa(ruta: str) -> Dict:
+    with open(ruta, encoding="utf-8") as fh:
+        return json.load(fh)
+
+
+def mapa_miniaturas(zip_path: str, indice: Dict, chap: int) -> Dict:
+    """{ancho, alto, celda, paginas: [{pagina, x, y, w, h}]} de la hoja (la genera si falta)."""
+    hoja, mapa = _rutas_miniaturas(indice, chap)
+    return _con_reintento(
+        hoja,
+        lambda: conversion_service.asegurar_miniaturas(zip_path, indice["capitulos"][chap], hoja, mapa),
+        lambda: _leer_mapa(mapa),
+    )
+
+
+def servir_miniaturas(zip_path: str, indice: Dict, chap: int):
+    hoja, mapa = _rutas_miniaturas(indice, chap)
+    return _con_reintento(
+        hoja,
+        lambda: conversion_service.asegurar_miniaturas(zip_path, indice["capitulos"][chap], hoja, mapa),
+        lambda: _cachear(entrega_service.enviar(hoja, "image/jpeg", max_age=MAX_AGE), indice),
+    )
+
+
+def informe(indice: Dict) -> Dict:
+    """Cuántas páginas van por copia directa (JPEG original, sin ancho) y por qué no el resto."""
+    motivos, por_capitulo, sin_extraer = Counter(), {}, 0
+    for chap, inners in sorted(indice["capitulos"].items()):
+        directas = 0
+        for p in inners:
+            motivo = conversion_service.motivo_recodificar(indice.get("paginas", {}).get(p))
+            if motivo is None:
+                directas += 1
+                sin_extraer += _desde_zip(indice, p, None, "jpeg") is not None
+            else:
+                motivos[motivo] += 1
+        por_capitulo[f"c{chap:03d}"] = {"paginas": len(inners), "directas": directas}
+    total = sum(c["paginas"] for c in por_capitulo.values())
+    directas = sum(c["directas"] for c in por_capitulo.values())
+    return {
+        "paginas":      total,
+        "directas":     directas,
+        "recodificadas": total - directas,
+        "sin_extraer":  sin_extraer,          # directas servidas desde el propio ZIP
+        "ratio_directas": round(directas / total, 3) if total else None,
+        "motivos":      dict(motivos),
+        "capitulos":    por_capitulo,
+    }
+
+
+# ───── API ───────────────────────────────────────────────────────────────────
+def servir(zip_path: str, indice: Dict, chap: int, filename: str):
+    """Respuesta Flask con la página `filename` del capítulo en el ancho y formato pedidos."""
+    ancho, formato = ancho_pedido(), formato_pedido()
+    target = next((p for p in indice["capitulos"].get(chap, []) if p.endswith(filename)), None)
+    if target is None:
+        abort(404)
+
+    sonda = _desde_zip(indice, target, ancho, formato)
+    if sonda is not None:
+        resp = _servir_desde_zip(zip_path, indice, sonda)
+    else:
+        dst = _ruta(indice, chap, filename, ancho, formato)
+        precarga_service.enfocar(precarga_service.cliente_actual(), dst)
+        resp = _no_modificado(indice, _etag(indice, dst))
+        if resp is not None:
+            cache_service.tocar(dst, True)
+        else:
+            resp = _con_reintento(
+                dst,
+                lambda: conversion_service.asegurar(zip_path, target, dst, ancho, formato,
+                                                    _copiar(indice, target, ancho, formato)),
+                lambda: _cachear(entrega_service.enviar(
+                    dst, conversion_service.FORMATOS[formato][1],
+                    etag=_etag(indice, dst), max_age=MAX_AGE), indice),
+            )
+    resp.vary.update(HINTS + ("Accept",))
+    resp.headers["Accept-CH"] = ", ".join(HINTS)
+    return resp
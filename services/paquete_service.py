@@ -0,0 +1,295 @@
+# services/paquete_service.py
+"""
+Descarga de un capítulo o volumen completo como un único TAR (lectura offline).
+
+Pedir página a página por `srv_vol_page` son miles de peticiones por volumen
+en redes móviles inestables.  Aquí todo el capítulo / volumen sale en una
+sola respuesta:
+
+* TAR sin comprimir (las páginas ya están comprimidas) con un diseño
+  determinista: `manifiesto.json` y luego `cNNN/<página>.<ext>` en orden de
+  lectura, cabeceras con fecha del ZIP, sin uid/gid.  Así el tamaño total y
+  la posición de cada byte se conocen antes de enviar nada.
+* Se arma al vuelo desde la caché de páginas (o desde el propio ZIP para los
+  miembros STORED), nunca entero en memoria: `_Paquete` es un archivo de solo
+  lectura "virtual" que concatena cabeceras y archivos.
+* ETag estable: hash del manifiesto (nombres, tamaños, dimensiones) y del
+  contenido de cada página (el hash de la rendición de `rendiciones`, o el CRC
+  del miembro si sale tal cual del ZIP).  Una página recodificada con otros
+  bytes cambia el ETag aunque mida lo mismo; los BlurHash no forman parte del
+  paquete (offline ya están las páginas), así que rellenarlos no lo cambia.
+  Con `Range` / `If-Range` una descarga interrumpida se reanuda donde se quedó.
+* Nada se convierte en el hilo de la petición: el diseño y el ETag salen del
+  índice (tamaños del disco o los que `tarea_medidas` apuntó en
+  `rendiciones`), así que un `If-None-Match` se contesta 304 aunque la caché
+  esté fría.  Si faltan páginas en la caché se encolan en precarga_service y
+  se contesta 202 con `Retry-After`; el cliente reintenta hasta que está lista.
+* Mientras dura la descarga sus capítulos están fijados en cache_service (no
+  se desalojan).  Si aun así una página cambia de tamaño, la descarga se corta
+  en vez de mandar un TAR corrupto con el mismo ETag.
+
+El permiso (compra) se comprueba una vez por paquete en main.py, no por página.
+"""
+from __future__ import annotations
+import bisect, hashlib, io, json, logging, os, tarfile
+from typing import Dict, List, Optional, Tuple
+
+from flask import current_app, jsonify, request
+from werkzeug.wsgi import wrap_file
+
+import services.cache_service as cache_service
+import services.conversion_service as conversion_service
+import services.pagina_service as pagina_service
+import services.precarga_service as precarga_service
+
+BLOQUE       = tarfile.BLOCKSIZE                 # 512
+PRIO_PAQUETE = 1_000                             # tras lo que un lector tiene delante, antes del fondo
+REINTENTO_S  = (2, 60)                           # Retry-After mínimo / máximo del 202
+
+logger = logging.getLogger(__name__)
+
+
+# ───── helpers ───────────────────────────────────────────────────────────────
+def _cabecera(nombre: str, tamano: int, mtime: int) -> bytes:
+    info = tarfile.TarInfo(nombre)
+    info.size, info.mtime, info.mode = tamano, mtime, 0o644
+    return info.tobuf(tarfile.USTAR_FORMAT if len(nombre) <= 100 else tarfile.PAX_FORMAT)
+
+
+def _relleno(tamano: int) -> bytes:
+    return b"\0" * (-tamano % BLOQUE)
+
+
+def _fuente(zip_path: str, indice: Dict, chap: int, inner: str,
+            ancho: Optional[int], formato: str
+            ) -> Tuple[str, str, int, Optional[int], Optional[str], bool]:
+    """
+    (nombre en el TAR, archivo, offset, bytes, hash del contenido, en disco)
+    de una página sin generar nada.  Bytes y hash de una rendición que no está
+    en la caché salen del índice (None si nunca se midió).
+    """
+    base = f"c{chap:03d}/{os.path.splitext(os.path.basename(inner))[0]}"
+    sonda = pagina_service._desde_zip(indice, inner, ancho, formato)
+    if sonda is not None:
+        crc = sonda.get("crc")
+        return (base + ".jpg", zip_path, sonda["offset"], sonda["bytes"],
+                None if crc is None else f"crc:{crc:08x}", True)
+
+    dst = pagina_service._ruta(indice, chap, inner, ancho, formato)
+    ext = conversion_service.FORMATOS[formato][0]
+    existe = os.path.isfile(dst)
+    hash_ = pagina_service._etag(indice, dst) if existe else None
+    if hash_ is not None:
+        tamano = os.path.getsize(dst)
+    else:
+        existe = False
+        guardada = indice.get("rendiciones", {}).get(pagina_service._clave_rendicion(dst))
+        tamano, hash_ = (guardada[0], guardada[2]) if guardada else (None, None)
+    cache_service.tocar(dst, existe)
+    return base + ext, dst, 0, tamano, hash_, existe
+
+
+class _Paquete(io.RawIOBase):
+    """
+    Archivo de solo lectura que concatena trozos: bytes en memoria (cabeceras,
+    relleno, manifiesto) o rangos de archivos en disco.  Abre como mucho un
+    archivo a la vez; si una página de la caché se desalojó entre medias se
+    regenera con `regenerar(ruta)`, y si no mide lo que dice el diseño se
+    lanza OSError (corta la respuesta).  `al_cerrar()` se llama una vez al
+    cerrarlo (fin o corte de la descarga).
+    """
+
+    def __init__(self, trozos: List[tuple], regenerar, al_cerrar=None):
+        self._inicios, self._trozos, pos = [], trozos, 0
+        for t in trozos:
+            self._inicios.append(pos)
+            pos += t[-1]
+        self._total, self._pos, self._regenerar = pos, 0, regenerar
+        self._abierto: Optional[tuple] = None            # (índice de trozo, archivo)
+        self._al_cerrar = al_cerrar
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, pos, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: self._total}[whence]
+        self._pos = max(0, min(self._total, base + pos))
+        return self._pos
+
+    def _archivo(self, i: int):
+        if self._abierto and self._abierto[0] == i:
+            return self._abierto[1]
+        self._cerrar_abierto()
+        ruta, offset, tamano = self._trozos[i]
+        try:
+            fh = open(ruta, "rb")
+        except FileNotFoundError:
+            self._regenerar(ruta)
+            fh = open(ruta, "rb")
+        real = os.fstat(fh.fileno()).st_size
+        if real < offset + tamano or (offset == 0 and real != tamano):
+            fh.close()
+            raise OSError(f"{ruta} cambió de tamaño durante la descarga")
+        self._abierto = (i, fh)
+        return fh
+
+    def readinto(self, b):
+        if self._pos >= self._total:
+            return 0
+        i = bisect.bisect_right(self._inicios, self._pos) - 1
+        trozo, dentro = self._trozos[i], self._pos - self._inicios[i]
+        n = min(len(b), trozo[-1] - dentro)
+        if isinstance(trozo[0], bytes):
+            b[:n] = trozo[0][dentro:dentro + n]
+        else:
+            fh = self._archivo(i)
+            fh.seek(trozo[1] + dentro)
+            n = fh.readinto(memoryview(b)[:n])
+            if not n:
+                raise OSError(f"{trozo[0]} terminó antes de lo esperado")
+        self._pos += n
+        return n
+
+    def _cerrar_abierto(self):
+        if self._abierto:
+            self._abierto[1].close()
+            self._abierto = None
+
+    def close(self):
+        self._cerrar_abierto()
+        al_cerrar, self._al_cerrar = self._al_cerrar, None
+        if al_cerrar is not None:
+            al_cerrar()
+        super().close()
+
+
+def _armar(zip_path: str, indice: Dict, capitulos: List[int], ancho: Optional[int],
+           formato: str) -> Tuple[List[tuple], Dict[str, tuple], Optional[str], List[tuple]]:
+    """
+    Trozos del TAR, páginas regenerables {ruta: args de asegurar}, ETag (None
+    si falta el tamaño o el hash de alguna página) y páginas que no están en
+    la caché (args de asegurar).  No convierte nada: lee el índice, hace
+    `stat` y, como mucho, calcula una vez el hash de una rendición sin medir.
+    """
+    mtime = int(indice["mtime_ns"] // 1_000_000_000)
+    fuentes, regenerables, faltan, hashes, por_capitulo = [], {}, [], [], []
+    for chap in capitulos:
+        paginas = []
+        for inner in indice["capitulos"][chap]:
+            nombre, ruta, offset, tamano, hash_, existe = _fuente(zip_path, indice, chap, inner,
+                                                                  ancho, formato)
+            fuentes.append((nombre, ruta, offset, tamano))
+            hashes.append(hash_)
+            if ruta != zip_path:
+                regenerables[ruta] = (zip_path, inner, ruta, ancho, formato,
+                                      pagina_service._copiar(indice, inner, ancho, formato))
+                if not existe:
+                    faltan.append(regenerables[ruta])
+            dims = conversion_service.dimensiones(indice.get("paginas", {}).get(inner), ancho)
+            paginas.append({"archivo": nombre, "ancho": dims and dims[0],
+                            "alto": dims and dims[1], "bytes": tamano})
+        por_capitulo.append({"capitulo": f"c{chap:03d}", "paginas": paginas})
+    if any(f[3] is None for f in fuentes) or None in hashes:
+        return [], regenerables, None, faltan
+
+    manifiesto = json.dumps({
+        "huella":    indice["huella"][:16],
+        "formato":   formato,
+        "ancho":     ancho,
+        "capitulos": por_capitulo,
+    }, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    trozos: List[tuple] = []
+    def memoria(datos: bytes):
+        if datos:
+            trozos.append((datos, len(datos)))
+
+    memoria(_cabecera("manifiesto.json", len(manifiesto), mtime))
+    memoria(manifiesto + _relleno(len(manifiesto)))
+    for nombre, ruta, offset, tamano in fuentes:
+        memoria(_cabecera(nombre, tamano, mtime))
+        trozos.append((ruta, offset, tamano))
+        memoria(_relleno(tamano))
+    memoria(b"\0" * (2 * BLOQUE))                        # fin de archivo TAR
+
+    # Manifiesto (diseño del TAR) + contenido de cada página: identifica el TAR entero
+    h = hashlib.sha1(manifiesto)
+    for hash_ in hashes:
+        h.update(b"\0" + hash_.encode("ascii"))
+    return trozos, regenerables, h.hexdigest()[:32], faltan
+
+
+def _preparar(zip_path: str, indice: Dict, capitulos: List[int], ancho: Optional[int],
+              formato: str, faltan: List[tuple]):
+    """Encola las páginas que faltan (y la medida de sus tamaños) y contesta 202."""
+    tareas = [
+        pagina_service.tarea_medidas(zip_path, indice, chap, indice["capitulos"][chap],
+                                     ancho, formato)
+        for chap in capitulos
+    ]
+    precarga_service.encolar(
+        "paquete-" + precarga_service.cliente_actual(),
+        f"{indice['huella'][:16]}-{ancho}-{formato}", faltan,
+        prioridad_base=PRIO_PAQUETE, tareas=[t for t in tareas if t is not None],
+    )
+    paginas = sum(len(indice["capitulos"][c]) for c in capitulos)
+    resp = jsonify({"code": 0, "msg": "Preparando la descarga, reintenta más tarde",
+                    "faltan": len(faltan), "paginas": paginas})
+    resp.status_code = 202
+    espera = len(faltan) // (10 * max(conversion_service.PROCESOS, 1))
+    resp.headers["Retry-After"] = str(max(REINTENTO_S[0], min(REINTENTO_S[1], espera)))
+    resp.cache_control.no_store = True
+    return resp
+
+
+# ───── API ───────────────────────────────────────────────────────────────────
+def servir(zip_path: str, indice: Dict, capitulos: List[int], nombre: str):
+    """
+    Respuesta Flask con el TAR de `capitulos` (en el ancho y formato pedidos,
+    como las páginas sueltas).  Admite Range / If-Range / If-None-Match.  Si
+    faltan páginas en la caché: 202 + Retry-After mientras se generan.
+    """
+    ancho, formato = pagina_service.ancho_pedido(), pagina_service.formato_pedido()
+    trozos, regenerables, etag, faltan = _armar(zip_path, indice, capitulos, ancho, formato)
+
+    if etag is not None and request.if_none_match.contains_weak(etag):
+        resp = current_app.response_class(status=304)
+        resp.set_etag(etag)
+        resp.cache_control.private = True
+        resp.vary.update(pagina_service.HINTS + ("Accept",))
+        return resp
+    if faltan:
+        return _preparar(zip_path, indice, capitulos, ancho, formato, faltan)
+
+    def regenerar(ruta: str):
+        logger.warning("Página desalojada durante la descarga, se regenera: %s", ruta)
+        conversion_service.asegurar(*regenerables[ruta])
+
+    testigo = cache_service.fijar(regenerables)
+    if not all(os.path.isfile(r) for r in regenerables):     # desalojadas antes de fijar
+        cache_service.soltar(testigo)
+        return _preparar(zip_path, indice, capitulos, ancho, formato,
+                         [a for r, a in regenerables.items() if not os.path.isfile(r)])
+    paquete = _Paquete(trozos, regenerar, lambda: cache_service.soltar(testigo))
+    resp = current_app.response_class(
+        wrap_file(request.environ, paquete), mimetype="application/x-tar",
+        direct_passthrough=True,
+    )
+    resp.content_length = paquete.seek(0, io.SEEK_END)
+    paquete.seek(0)
+    resp.last_modified = indice["mtime_ns"] / 1e9
+    resp.headers["Content-Disposition"] = f'attachment; filename="{nombre}.tar"'
+    resp.cache_control.private = True
+    resp.set_etag(etag)
+    resp.vary.update(pagina_service.HINTS + ("Accept",))
+    resp = resp.make_conditional(request.environ, accept_ranges=True,
+                                 complete_length=resp.content_length)
+    if resp.status_code not in (200, 206):          # 304 / 416: el cuerpo no se leerá
+        paquete.close()
+    return resp
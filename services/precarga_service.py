@@ -0,0 +1,242 @@
+# services/precarga_service.py
+"""
+Planificador del precalentamiento de páginas.
+
+Antes `listar_paginas` hacía `executor.submit()` de todas las páginas del
+capítulo en cada llamada: sin deduplicar ni límite, y la página que el lector
+tenía delante esperaba detrás de miles de trabajos repetidos.
+
+* Cola con prioridad (heap): primero las primeras páginas del capítulo y, en
+  cuanto el lector pide una página, las que vienen justo después (`enfocar`).
+* Deduplicación por clave de caché (ruta destino): un trabajo ya en cola solo
+  suma interesados y se queda con la mejor prioridad.
+* Cola acotada (PRECARGA_MAX_COLA): si se llena se descarta el trabajo de
+  peor prioridad (y se avisa en el log de cuántos).  Los precalentamientos
+  grandes (volumen entero) se encolan por capítulos con `esperar_hueco`.
+* Cancelación: cada cliente tiene un capítulo activo; al listar otro, sus
+  trabajos pendientes del anterior se cancelan (salvo que otro cliente
+  también los quiera).
+* Métricas: profundidad, esperas (media / p95 / máx.), cancelados, etc.
+
+Los hilos del planificador solo esperan al motor de conversion_service, que
+es quien hace el trabajo en su pool de procesos.
+"""
+from __future__ import annotations
+import hashlib, heapq, itertools, logging, os, threading, time
+from collections import deque
+from typing import Callable, Dict, List, Optional, Tuple
+
+from flask import has_request_context, request
+
+import services.conversion_service as conversion_service
+
+HILOS        = int(os.getenv("PRECARGA_HILOS", max(conversion_service.PROCESOS, 1)))
+MAX_COLA     = int(os.getenv("PRECARGA_MAX_COLA", 2000))
+MAX_CLIENTES = 10_000            # capítulos activos recordados (uno por cliente)
+PRIO_FONDO   = 10_000            # precalentamientos sin lector esperando (aprobación)
+
+logger = logging.getLogger(__name__)
+
+Pagina = Tuple[str, str, str, Optional[int], str, bool]   # args de conversion_service.asegurar
+Tarea  = Tuple[str, Callable, tuple]                      # (clave, función, args)
+
+
+class _Trabajo:
+    __slots__ = ("clave", "fn", "args", "prio", "seq", "encolado", "interesados")
+
+    def __init__(self, clave: str, fn: Callable, args: tuple, prio: int, seq: int, cliente: str):
+        self.clave       = clave
+        self.fn          = fn
+        self.args        = args
+        self.prio        = prio
+        self.seq         = seq
+        self.encolado    = time.monotonic()
+        self.interesados = {cliente}
+
+
+_lock      = threading.RLock()
+_cond      = threading.Condition(_lock)        # hay trabajo en cola
+_hueco     = threading.Condition(_lock)        # ha salido trabajo de la cola
+_heap: List[tuple] = []                        # (prio, seq, clave); entradas viejas se saltan
+_trabajos: Dict[str, _Trabajo] = {}            # clave → trabajo pendiente
+_activo:   Dict[str, Tuple[str, List[str]]] = {}   # cliente → (grupo, claves en orden)
+_contador  = itertools.count()
+_hilos_pid: Optional[int] = None
+_esperas   = deque(maxlen=1000)                # ms en cola de los últimos trabajos
+_stats     = {"encolados": 0, "deduplicados": 0, "cancelados": 0, "descartados": 0,
+              "ejecutados": 0, "errores": 0}
+
+
+# ───── helpers ───────────────────────────────────────────────────────────────
+def cliente_actual() -> str:
+    """Identificador estable del lector de la petición (token o IP)."""
+    if not has_request_context():
+        return "anon"
+    ident = request.headers.get("Authorization") or request.remote_addr or "anon"
+    return hashlib.sha1(ident.encode("utf-8")).hexdigest()[:12]
+
+
+def _arrancar_hilos() -> None:
+    """Hilos perezosos, uno por proceso (se relanzan tras un fork)."""
+    global _hilos_pid
+    if _hilos_pid == os.getpid():
+        return
+    _hilos_pid = os.getpid()
+    for i in range(HILOS):
+        threading.Thread(target=_bucle, name=f"precarga-{i}", daemon=True).start()
+
+
+def _empujar(t: _Trabajo, prio: int) -> None:
+    t.prio, t.seq = prio, next(_contador)
+    heapq.heappush(_heap, (t.prio, t.seq, t.clave))
+
+
+def _quitar(clave: str) -> None:
+    _trabajos.pop(clave, None)
+    if len(_heap) > 4 * len(_trabajos) + 64:   # compactar entradas obsoletas
+        _heap[:] = [(t.prio, t.seq, t.clave) for t in _trabajos.values()]
+        heapq.heapify(_heap)
+
+
+def _hay_sitio(prio: int) -> bool:
+    if len(_trabajos) < MAX_COLA:
+        return True
+    peor = max(_trabajos.values(), key=lambda t: (t.prio, t.seq))
+    if peor.prio <= prio:
+        return False
+    _quitar(peor.clave)
+    _stats["descartados"] += 1
+    return True
+
+
+def _cancelar_cliente(cliente: str) -> None:
+    grupo = _activo.pop(cliente, None)
+    if grupo is None:
+        return
+    for clave in grupo[1]:
+        t = _trabajos.get(clave)
+        if t is None:
+            continue
+        t.interesados.discard(cliente)
+        if not t.interesados:
+            _quitar(clave)
+            _stats["cancelados"] += 1
+    _hueco.notify_all()
+
+
+def _bucle() -> None:
+    while True:
+        with _cond:
+            while True:
+                while not _heap:
+                    _cond.wait()
+                prio, seq, clave = heapq.heappop(_heap)
+                t = _trabajos.get(clave)
+                if t is not None and t.seq == seq:
+                    break
+            _trabajos.pop(clave, None)
+            _hueco.notify_all()
+            _esperas.append(1_000 * (time.monotonic() - t.encolado))
+        try:
+            t.fn(*t.args)
+            with _cond:
+                _stats["ejecutados"] += 1
+        except Exception as e:
+            with _cond:
+                _stats["errores"] += 1
+            logger.debug("Precarga fallo %s → %s", t.clave, e)
+
+
+# ───── API ───────────────────────────────────────────────────────────────────
+def encolar(cliente: str, grupo: str, paginas: List[Pagina],
+            prioridad_base: int = 0, tareas: List[Tarea] = ()) -> None:
+    """
+    Encola `paginas` (en orden de lectura) y luego `tareas` (p. ej. hojas de
+    miniaturas) para `cliente`.  Si el cliente tenía otro grupo (capítulo)
+    activo, sus trabajos pendientes se cancelan.
+    """
+    _arrancar_hilos()
+    trabajos = [(p[2], conversion_service.asegurar, p) for p in paginas] + list(tareas)
+    claves = [clave for clave, _, _ in trabajos]
+    sin_sitio = 0
+    with _cond:
+        desalojados = _stats["descartados"]
+        anterior = _activo.get(cliente)
+        if anterior is not None and anterior[0] != grupo:
+            _cancelar_cliente(cliente)
+        _activo.pop(cliente, None)
+        _activo[cliente] = (grupo, claves)        # al final: el más reciente
+        while len(_activo) > MAX_CLIENTES:
+            _activo.pop(next(iter(_activo)))
+
+        for i, (clave, fn, args) in enumerate(trabajos):
+            prio = prioridad_base + i
+            t = _trabajos.get(clave)
+            if t is not None:
+                t.interesados.add(cliente)
+                if prio < t.prio:
+                    _empujar(t, prio)
+                _stats["deduplicados"] += 1
+                continue
+            if os.path.isfile(clave):
+                continue
+            if not _hay_sitio(prio):
+                sin_sitio += 1
+                continue
+            t = _trabajos[clave] = _Trabajo(clave, fn, args, prio, 0, cliente)
+            _empujar(t, prio)
+            _stats["encolados"] += 1
+        desalojados = _stats["descartados"] - desalojados
+        _stats["descartados"] += sin_sitio
+        _cond.notify_all()
+    if sin_sitio or desalojados:
+        logger.warning("Cola de precarga llena (%d): %d trabajos de %s descartados, "
+                       "%d de menor prioridad desalojados", MAX_COLA, sin_sitio, grupo, desalojados)
+
+
+def esperar_hueco(cantidad: int, timeout: Optional[float] = None) -> bool:
+    """
+    Bloquea hasta que caben `cantidad` trabajos más en la cola (o hasta que se
+    vacía, si no caben ni con la cola vacía).  Para productores de fondo que
+    encolan por tandas; False si vence `timeout`.
+    """
+    with _hueco:
+        return _hueco.wait_for(lambda: not _trabajos or len(_trabajos) + cantidad <= MAX_COLA,
+                               timeout)
+
+
+def enfocar(cliente: str, clave: str) -> None:
+    """
+    El cliente acaba de pedir la página `clave`: las siguientes de su grupo
+    pasan delante de todo y las anteriores al final.
+    """
+    with _cond:
+        grupo = _activo.get(cliente)
+        if grupo is None or clave not in grupo[1]:
+            return
+        claves = grupo[1]
+        foco, n = claves.index(clave), len(claves)
+        for j, c in enumerate(claves):
+            t = _trabajos.get(c)
+            if t is not None and t.prio < PRIO_FONDO:
+                _empujar(t, j - foco if j >= foco else n + foco - j)
+        _cond.notify_all()
+
+
+def cancelar(cliente: str) -> None:
+    with _cond:
+        _cancelar_cliente(cliente)
+
+
+def estadisticas() -> Dict:
+    with _cond:
+        esperas = sorted(_esperas)
+        return {
+            **_stats,
+            "profundidad": len(_trabajos),
+            "clientes":    len(_activo),
+            "hilos":       HILOS,
+            "espera_media_ms": round(sum(esperas) / len(esperas), 1) if esperas else None,
+            "espera_p95_ms":   round(esperas[int(0.95 * (len(esperas) - 1))], 1) if esperas else None,
+            "espera_max_ms":   round(esperas[-1], 1) if esperas else None,
+        }
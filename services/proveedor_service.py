@@ -1,4 +1,6 @@
 import db.database as db
+import services.identidad_service as identidad_service
+import services.ingesta_service as ingesta_service
 from datetime import datetime
 from pymysql.cursors import DictCursor
 from flask import current_app
@@ -47,7 +49,7 @@ def cancelar_solicitud_proveedor(email):
         print("Error:", e)
         return {"code": 1, "msg": "Error interno del servidor"}, 500
     
-def registrar_solicitud(email_user, data):
+def registrar_solicitud(email_user, data, id_user=None):
     try:
         # Validar campos obligatorios (sin id_user)
         campos_obligatorios = ("tipo", "titulo", "autores",
@@ -59,18 +61,19 @@ def registrar_solicitud(email_user, data):
                 "msg": f"Faltan campos obligatorios: {', '.join(faltantes)}"
             }, 400
 
+        # El ZIP ya se verificó al subirlo: no se admiten archivos rotos
+        motivo = ingesta_service.rechazo(data["url_zip"])
+        if motivo:
+            return {"code": 1, "msg": f"El ZIP no superó la verificación: {motivo}"}, 400
+
+        # 1) Obtener id_user a partir del email (si no viene del JWT)
+        if id_user is None:
+            id_user = identidad_service.id_user_por_email(email_user)
+            if id_user is None:
+                return {"code": 1, "msg": "Usuario no encontrado"}, 404
+
         with db.obtener_conexion() as conexion:
             with conexion.cursor(DictCursor) as cursor:
-                # 1) Obtener id_user a partir del email
-                cursor.execute(
-                    "SELECT id_user FROM usuario WHERE email = %s",
-                    (email_user,)
-                )
-                fila = cursor.fetchone()
-                if not fila:
-                    return {"code": 1, "msg": "Usuario no encontrado"}, 404
-                id_user = fila["id_user"]
-
                 # 2) Insertar solicitud con estado 'pendiente'
                 sql = """
                     INSERT INTO solicitud_publicacion (
@@ -197,7 +200,7 @@ def editar_solicitud_publicacion(data):
         print("Error al editar solicitud:", e)
         return {"code": 1, "msg": "Error interno del servidor"}, 500
     
-def rechazar_solicitud_publicacion(id_solicitud: int):
+def rechazar_solicitud_publicacion(id_solicitud: int, id_admin=None):
     """
     Rechaza una solicitud:
     • Cambia estado a 'rechazado'
@@ -205,15 +208,13 @@ def rechazar_solicitud_publicacion(id_solicitud: int):
     • Registra quién la rechazó en id_usuario_respuesta
     """
     try:
-        with db.obtener_conexion() as conexion, conexion.cursor(DictCursor) as cursor:
-            # 1) Derivo el id del admin desde el JWT
-            email_admin = get_jwt_identity()
-            cursor.execute("SELECT id_user FROM usuario WHERE email = %s", (email_admin,))
-            admin_row = cursor.fetchone()
-            if not admin_row:
-                return {"code": 1, "msg": "Admin no encontrado"}, 403
-            id_admin = admin_row["id_user"] if isinstance(admin_row, dict) else admin_row[0]
+        # 1) Derivo el id del admin desde el JWT (si la ruta no lo resolvió ya)
+        if id_admin is None:
+            id_admin = identidad_service.id_user_por_email(get_jwt_identity())
+        if id_admin is None:
+            return {"code": 1, "msg": "Admin no encontrado"}, 403
 
+        with db.obtener_conexion() as conexion, conexion.cursor(DictCursor) as cursor:
             # 2) Marco la solicitud como rechazada y grabo auditoría
             cursor.execute("""
                 UPDATE solicitud_publicacion
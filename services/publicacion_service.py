@@ -13,10 +13,12 @@ import db.database as db
 # ▸ Re-utilizamos toda la lógica de clasificación / caché del módulo de solicitudes
 from services.solicitud_service import (
     _catalog,           # dado un id_solicitud   → {capítulo: [files]}
-    _cache_path,        # (id_solicitud, cap, filename) → ruta JPEG en CACHE_DIR
-    _warm_cache,        # genera la entrada JPEG on-demand
+    _paginas_precarga,  # (zip, cap, [files]) → trabajos para precarga_service
+    _indice,            # ruta ZIP → índice persistente (capítulos, huella…)
     _zip_path           # id_solicitud → ruta ZIP absoluta
 )
+import services.precarga_service as precarga_service
+import services.pagina_service as pagina_service
 
 # carpeta donde viven los ZIP subidos por los autores
 UPLOAD_DIR = os.path.join(os.path.dirname(__file__), "..",
@@ -116,12 +118,14 @@ def aprobar_solicitud(id_solicitud: int, id_admin: int):
 
             cn.commit()
 
-        # 7) Precalentar caché en background
-        threading.Thread(
+        # 7) Precalentar caché en background (tras el COMMIT real; el hilo no
+        #    hereda el contexto de la app, se le pasa la app)
+        app = current_app._get_current_object()
+        db.al_confirmar(lambda: threading.Thread(
             target=_precalentar_volumen,
-            args=(id_solicitud,),
+            args=(app, id_solicitud),
             daemon=True
-        ).start()
+        ).start())
 
         return {"code": 0, "msg": f"Historieta publicada (ID {id_hist})"}, 200
 
@@ -135,27 +139,39 @@ def aprobar_solicitud(id_solicitud: int, id_admin: int):
         return {"code": 1, "msg": "Error interno al aprobar"}, 500
 
 # ════════════════  PRECALENTAMIENTO DE CACHÉ  ════════════════════════════════
-def _precalentar_volumen(id_solicitud: int):
+def _precalentar_volumen(app, id_solicitud: int):
     """
     Recorre TODO el ZIP asociado a la solicitud y fuerza la generación de todas
     las entradas JPEG en CACHE_DIR para que el lector móvil las obtenga al
-    instante.  Re-utiliza _warm_cache() del módulo de solicitudes.
+    instante.  Se encola con prioridad de fondo en precarga_service: los
+    lectores que están leyendo pasan siempre delante.  Corre en un hilo propio,
+    dentro de un contexto de `app`, y encola capítulo a capítulo según se
+    vacía la cola (el volumen entero no cabe en PRECARGA_MAX_COLA).
     """
     try:
-        # Obtener la app de Flask
-        from flask import current_app
-        app = current_app._get_current_object()
         with app.app_context():
             cat = _catalog(id_solicitud)  # {capítulo: [lista archivos]}
-            for chap, files in cat.items():
-                for f in files:
-                    _warm_cache(id_solicitud, chap, os.path.basename(f))
-            current_app.logger.info("Caché precalentada para solicitud %s", id_solicitud)
-    except Exception as exc:
-        # Usar print como fallback si no hay contexto
-        try:
-            current_app.logger.warning(
-                "Precalentamiento solicitud %s falló: %s", id_solicitud, exc
-            )
-        except Exception:
-            print(f"Precalentamiento solicitud {id_solicitud} falló: {exc}")
+            zip_path = _zip_path(id_solicitud)
+            indice = _indice(zip_path)
+            prio, total = precarga_service.PRIO_FONDO, 0
+            for chap in sorted(cat):
+                paginas = _paginas_precarga(zip_path, chap, cat[chap],
+                                            pagina_service.PRECARGA,
+                                            pagina_service.FORMATOS_PRECARGA)
+                tareas = [pagina_service.tarea_miniaturas(zip_path, indice, chap)] + [
+                    pagina_service.tarea_medidas(zip_path, indice, chap, cat[chap], ancho, formato)
+                    for ancho in pagina_service.PRECARGA
+                    for formato in pagina_service.FORMATOS_PRECARGA
+                ]
+                tareas = [t for t in tareas if t is not None]
+                precarga_service.esperar_hueco(len(paginas) + len(tareas))
+                precarga_service.encolar(
+                    f"aprobacion-{id_solicitud}", f"s{id_solicitud}", paginas,
+                    prioridad_base=prio, tareas=tareas,
+                )
+                prio  += len(paginas) + len(tareas)
+                total += len(paginas)
+            app.logger.info("Precalentamiento encolado para solicitud %s (%d capítulos, %d páginas)",
+                            id_solicitud, len(cat), total)
+    except Exception:
+        app.logger.exception("Precalentamiento solicitud %s falló", id_solicitud)
@@ -1,25 +1,31 @@
 """
 services/solicitud_service.py  –  edición 2025-06-18
 ────────────────────────────────────────────────────
-* Clasifica capítulos (regex + reset) con caché LRU.
-* Recodifica todas las páginas a JPEG RGB quality 85.
-* Usa ThreadPoolExecutor (8 hilos) para precargar el capítulo.
+* Clasifica capítulos (regex + reset); el resultado persiste en un índice
+  por ZIP (services/catalogo_service.py) compartido por todos los workers.
+* Recodifica las páginas (JPEG, o WebP/AVIF según Accept) en static/cache/<huella ZIP>/,
+  la misma caché que usa el lector de volúmenes publicados; `?w=` / client
+  hints eligen una rendición más estrecha (pagina_service).
+* Precarga el capítulo con precarga_service (cola con prioridad, sin
+  duplicados y cancelable); cada página se convierte una sola vez aunque la
+  pidan a la vez el precalentamiento y el lector (conversion_service).
 * send_file → conditional=True (304 cuando procede).
 """
 
 from __future__ import annotations
-import io, os, re, zipfile, itertools, logging, time, yaml
+import os, re, zipfile, itertools, logging, time, yaml
 from collections import defaultdict
-from contextlib import contextmanager
 from functools import lru_cache
 from typing import Dict, List
 
-from PIL import Image
-from flask import abort, current_app, send_file, url_for
+from flask import abort, url_for
 from pymysql.cursors import DictCursor
-from concurrent.futures import ThreadPoolExecutor
 
 import db.database as db
+import services.catalogo_service as catalogo_service
+import services.conversion_service as conversion_service
+import services.precarga_service as precarga_service
+import services.pagina_service as pagina_service
 
 # ───── Config ────────────────────────────────────────────────────────────────
 BASE_DIR   = os.path.abspath(os.path.dirname(__file__))
@@ -27,13 +33,12 @@ UPLOAD_DIR = os.path.join(BASE_DIR, "..", "static", "uploads", "zips")
 CACHE_DIR  = os.path.join(BASE_DIR, "..", "static", "cache")
 RULES_FILE = os.path.join(BASE_DIR, "rules.yml")
 
-MAX_PX           = 4096
+MAX_PX           = conversion_service.MAX_PX
 RESET_THRESHOLD  = 5
 MIN_PAGES_CHAP   = 8
 ORPHAN_TOLERANCE = 0.03
 
-logger   = logging.getLogger(__name__)
-executor = ThreadPoolExecutor(max_workers=8)
+logger = logging.getLogger(__name__)
 
 # ───── Regex rules ───────────────────────────────────────────────────────────
 def _load_rules():
@@ -70,14 +75,6 @@ def _zip_path(sid: int) -> str:
         abort(404, "ZIP no encontrado")
     return path
 
-@contextmanager
-def _zip_open(sid: int):
-    try:
-        with zipfile.ZipFile(_zip_path(sid), "r") as zf:
-            yield zf
-    except zipfile.BadZipFile:
-        abort(500, "ZIP corrupto")
-
 # ───── Catálogo ──────────────────────────────────────────────────────────────
 def _is_img(n: str) -> bool:
     return (
@@ -121,33 +118,43 @@ def _detect(zf: zipfile.ZipFile):
         for c, v in chap.items()
     }
 
-@lru_cache(maxsize=256)
+# Si cambian las reglas o los umbrales de corte, los índices se regeneran
+_FIRMA_REGLAS = catalogo_service.firma(
+    [rx.pattern for rx in RULES], RESET_THRESHOLD, MIN_PAGES_CHAP
+)
+
+def _indice(zip_path: str):
+    """Índice persistente del ZIP (capítulos, huella…)."""
+    try:
+        return catalogo_service.obtener(
+            zip_path, _detect, _FIRMA_REGLAS, conversion_service.sondear
+        )
+    except zipfile.BadZipFile:
+        abort(500, "ZIP corrupto")
+
 def _catalog(sid: int):
-    with _zip_open(sid) as zf:
-        return _detect(zf)
+    return _indice(_zip_path(sid))["capitulos"]
 
 # ───── Conversión + caché ───────────────────────────────────────────────────
-def _cache_path(sid: int, chap: int, filename: str):
-    return os.path.join(
-        CACHE_DIR, str(sid), f"c{chap:03d}", os.path.splitext(filename)[0] + ".jpg"
+def _paginas_precarga(zip_path: str, chap: int, inners: List[str],
+                      anchos=(None,), formatos=("jpeg",)):
+    """[(zip, interna, destino, ancho, formato)] en orden de lectura para precarga_service."""
+    return pagina_service.paginas_precarga(
+        zip_path, _indice(zip_path), chap, inners, anchos, formatos
     )
 
-def _convert_only(zip_path: str, inner: str, dst: str):
-    with zipfile.ZipFile(zip_path) as zf, zf.open(inner) as fp:
-        img = Image.open(fp)
-        if max(img.size) > MAX_PX:
-            img.thumbnail((MAX_PX, MAX_PX), Image.LANCZOS)
-        if img.mode != "RGB":
-            img = img.convert("RGB")
-        os.makedirs(os.path.dirname(dst), exist_ok=True)
-        img.save(dst, "JPEG", quality=85, optimize=True, progressive=True)
-
-def _warm_cache(sid: int, chap: int, filename: str):
-    try:
-        inner = next(p for p in _catalog(sid)[chap] if p.endswith(filename))
-        _convert_only(_zip_path(sid), inner, _cache_path(sid, chap, filename))
-    except Exception as e:
-        logger.debug("Prewarm fallo %s/%s/%s → %s", sid, chap, filename, e)
+def precargar_capitulo(zip_path: str, chap: int, inners: List[str], ancho: int | None = None):
+    """Precarga del capítulo (en el ancho y formato del cliente) que se va a leer."""
+    indice  = _indice(zip_path)
+    formato = pagina_service.formato_pedido()
+    tareas  = [pagina_service.tarea_miniaturas(zip_path, indice, chap),
+               pagina_service.tarea_medidas(zip_path, indice, chap, inners, ancho, formato)]
+    precarga_service.encolar(
+        precarga_service.cliente_actual(),
+        f"{indice['huella'][:16]}/c{chap:03d}",
+        _paginas_precarga(zip_path, chap, inners, (ancho,), (formato,)),
+        tareas=[t for t in tareas if t is not None],
+    )
 
 # ───── Endpoints ─────────────────────────────────────────────────────────────
 def listar_capitulos(sid: int):
@@ -160,40 +167,33 @@ def listar_paginas(sid: int, chap_name: str):
     if chap not in cat:
         return {"code": 1, "msg": "Capítulo no encontrado"}, 404
 
+    ancho  = pagina_service.ancho_pedido()
+    indice = _indice(_zip_path(sid))
     pages = [
         url_for("serve_chapter_page",
-                id=sid, chapter=chap_name,
-                filename=os.path.basename(p), _external=True)
+                id=sid, chapter=chap_name, filename=os.path.basename(p),
+                w=ancho, v=indice["huella"][:16], _external=True)
         for p in cat[chap]
     ]
+    medidas = pagina_service.manifiesto(indice, chap, ancho, pagina_service.formato_pedido())
 
-    # Lanzar precalentamiento sin bloquear
-    for p in cat[chap]:
-        executor.submit(_warm_cache, sid, chap, os.path.basename(p))
+    # Precalentamiento sin bloquear (cancela el capítulo anterior del cliente)
+    precargar_capitulo(_zip_path(sid), chap, cat[chap], ancho)
 
     logger.debug("listar_paginas %s/c%03d → %.1f ms",
                  sid, chap, 1_000*(time.perf_counter() - t0))
-    return {"code": 0, "pages": pages}, 200
+    return {"code": 0, "pages": pages,
+            "paginas": [{"url": u, **m} for u, m in zip(pages, medidas)],
+            "anchos": list(pagina_service.ANCHOS)}, 200
 
 def serve_chapter_page(id: int, chapter: str, filename: str):
     t0   = time.perf_counter()
     chap = int(chapter.lstrip("c"))
-    dst  = _cache_path(id, chap, filename)
-
-    # 1 – si está en caché
-    if os.path.isfile(dst):
-        return send_file(dst, mimetype="image/jpeg",
-                         max_age=31536000, conditional=True)
-
-    # 2 – generar JPEG y servir
-    cat = _catalog(id)
-    target = [p for p in cat.get(chap, []) if p.endswith(filename)]
-    if not target:
-        abort(404)
+    zip_path = _zip_path(id)
 
-    _convert_only(_zip_path(id), target[0], dst)
+    # caché (en el ancho pedido) o conversión al vuelo
+    resp = pagina_service.servir(zip_path, _indice(zip_path), chap, filename)
 
     logger.debug("serve_page %s/c%03d/%s %.1f ms",
                  id, chap, filename, 1_000*(time.perf_counter() - t0))
-    return send_file(dst, mimetype="image/jpeg",
-                     max_age=31536000, conditional=True)
+    return resp
@@ -55,6 +55,7 @@ def crear_devolucion(payment_intent_id: str, amount_cents: int) -> stripe.Refund
 def _save_stripe_pi(order_id: int, pi_id: str) -> None:
     """
     Guarda el ID del PaymentIntent en la fila correspondiente de la tabla 'venta'.
+    Se confirma en el acto: el PaymentIntent ya existe en Stripe.
     """
     with db.obtener_conexion() as cn, cn.cursor() as cur:
         cur.execute(
@@ -62,6 +63,7 @@ def _save_stripe_pi(order_id: int, pi_id: str) -> None:
             (pi_id, order_id)
         )
         cn.commit()
+    db.confirmar_ya()
 
 
 def generar_payment_sheet(
@@ -98,8 +100,17 @@ def generar_payment_sheet(
         metadata={"order_id": order_id},
     )
 
-    # 4) Guarda el payment_intent_id en la fila de 'venta'
-    _save_stripe_pi(order_id, intent.id)
+    # 4) Guarda el payment_intent_id en la fila de 'venta'; si no se puede,
+    #    se cancela el intent para no dejar un cobro posible sin venta
+    try:
+        _save_stripe_pi(order_id, intent.id)
+    except Exception:
+        log.exception("No se pudo guardar PI %s para order %s; se cancela", intent.id, order_id)
+        try:
+            stripe.PaymentIntent.cancel(intent.id)
+        except Exception:
+            log.exception("No se pudo cancelar PI %s", intent.id)
+        raise
 
     log.debug(
         "PI %s / Customer %s creado para order %s (%s %s)",
@@ -1,4 +1,5 @@
 import db.database as db
+import services.identidad_service as identidad_service
 from datetime import datetime
 from pymysql.cursors import DictCursor
 from flask import current_app   
@@ -9,7 +10,13 @@ def obtener_usuario(email):
         with db.obtener_conexion() as conexion:
             with conexion.cursor() as cursor:
                 cursor.execute(
-                    "SELECT id_user, email, pass, id_rol, proveedor_solicitud, proveedor_aprobado, proveedor_fecha_solicitud FROM usuario WHERE email = %s", (email,))
+                    """
+                    SELECT u.id_user, u.email, u.pass, u.id_rol, u.proveedor_solicitud,
+                           u.proveedor_aprobado, u.proveedor_fecha_solicitud, l.id_lec
+                      FROM usuario u
+                      LEFT JOIN lector l ON l.id_user = u.id_user
+                     WHERE u.email = %s
+                    """, (email,))
                 usuario = cursor.fetchone()
         return usuario  # <-- retorna el dict directamente
     except Exception as e:
@@ -23,7 +30,7 @@ def get_historietas():
     las cargue y filtre localmente en el frontend.
     """
     try:
-        with db.obtener_conexion() as conexion:
+        with db.obtener_conexion(solo_lectura=True) as conexion:
             with conexion.cursor(DictCursor) as cursor:
                 cursor.execute("""
                     SELECT
@@ -112,6 +119,7 @@ def registrar_usuario(email_user, pass_user, id_rol, proveedor_solicitud=False,
                 )
                 id_user = cursor.lastrowid
             conexion.commit()
+        identidad_service.invalidar(email=email_user)
         return id_user
     except Exception as e:
         print("Error:", e)
@@ -0,0 +1,144 @@
+# services/zip_pool_service.py
+"""
+Pool por proceso de ZipFile abiertos (LRU).
+
+Abrir un ZipFile vuelve a leer todo el directorio central; se hacía en cada
+página convertida, en cada servicio y al construir el catálogo.  Aquí cada
+ZIP se abre una vez y se reutiliza:
+
+* clave (ruta, mtime_ns, tamaño): si el ZIP se reemplaza se abre de nuevo y
+  la versión vieja se retira;
+* préstamos con contador de referencias: una entrada desalojada o retirada
+  no se cierra hasta que el último lector la suelta;
+* ZIP_POOL_MAX archivos abiertos como máximo (descriptores por proceso).
+
+Un ZipFile abierto por ruta admite lecturas concurrentes de varios hilos
+(zipfile serializa el acceso al archivo compartido), así que el mismo objeto
+se presta a todos.
+"""
+from __future__ import annotations
+import logging, os, struct, threading, zipfile
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Iterator, Tuple
+
+MAX_ABIERTOS = int(os.getenv("ZIP_POOL_MAX", 32))
+
+logger = logging.getLogger(__name__)
+
+
+class _Entrada:
+    __slots__ = ("zf", "refs", "retirada")
+
+    def __init__(self, zf: zipfile.ZipFile):
+        self.zf       = zf
+        self.refs     = 0
+        self.retirada = False
+
+
+_lock     = threading.Lock()
+_abiertos: "OrderedDict[Tuple[str, int, int], _Entrada]" = OrderedDict()
+_pid      = os.getpid()
+_stats    = {"aciertos": 0, "aperturas": 0, "cierres": 0}
+
+
+# ───── helpers (con _lock tomado) ────────────────────────────────────────────
+def _cerrar(e: _Entrada) -> None:
+    try:
+        e.zf.close()
+    except Exception:
+        logger.debug("Error cerrando %s", e.zf.filename, exc_info=True)
+    _stats["cierres"] += 1
+
+
+def _retirar(clave) -> None:
+    e = _abiertos.pop(clave)
+    if e.refs:
+        e.retirada = True                 # se cierra al soltar el último préstamo
+    else:
+        _cerrar(e)
+
+
+def _tras_fork() -> None:
+    """Tras un fork los descriptores comparten offset con el padre: no se usan."""
+    global _pid
+    if _pid != os.getpid():
+        _abiertos.clear()
+        _pid = os.getpid()
+
+
+def _tomar(clave) -> _Entrada:
+    with _lock:
+        _tras_fork()
+        e = _abiertos.get(clave)
+        if e is not None:
+            _abiertos.move_to_end(clave)
+            e.refs += 1
+            _stats["aciertos"] += 1
+            return e
+
+    zf = zipfile.ZipFile(clave[0], "r")        # fuera del lock; puede lanzar BadZipFile
+
+    with _lock:
+        e = _abiertos.get(clave)
+        if e is not None:                      # otro hilo lo abrió a la vez
+            zf.close()
+            e.refs += 1
+            return e
+        for vieja in [k for k in _abiertos if k[0] == clave[0]]:
+            _retirar(vieja)                    # el ZIP cambió en disco
+        e = _abiertos[clave] = _Entrada(zf)
+        e.refs = 1
+        _stats["aperturas"] += 1
+        while len(_abiertos) > MAX_ABIERTOS:
+            _retirar(next(iter(_abiertos)))
+        return e
+
+
+def _soltar(e: _Entrada) -> None:
+    with _lock:
+        e.refs -= 1
+        if e.retirada and not e.refs:
+            _cerrar(e)
+
+
+# ───── API ───────────────────────────────────────────────────────────────────
+@contextmanager
+def abrir(zip_path: str) -> Iterator[zipfile.ZipFile]:
+    """
+    `with abrir(ruta) as zf:` — ZipFile compartido en modo lectura.
+    No cerrar `zf` a mano.  Lanza zipfile.BadZipFile / OSError como ZipFile().
+    """
+    st = os.stat(zip_path)
+    e  = _tomar((os.path.abspath(zip_path), st.st_mtime_ns, st.st_size))
+    try:
+        yield e.zf
+    finally:
+        _soltar(e)
+
+
+def offset_datos(zip_path: str, info: zipfile.ZipInfo) -> int:
+    """Posición absoluta de los datos de un miembro (tras su cabecera local)."""
+    with open(zip_path, "rb") as fh:
+        fh.seek(info.header_offset)
+        cabecera = fh.read(30)
+    if cabecera[:4] != b"PK\x03\x04":
+        raise zipfile.BadZipFile(f"Cabecera local inválida: {info.filename}")
+    n_nombre, n_extra = struct.unpack("<HH", cabecera[26:30])
+    return info.header_offset + 30 + n_nombre + n_extra
+
+
+def cerrar_todo() -> None:
+    with _lock:
+        for clave in list(_abiertos):
+            _retirar(clave)
+
+
+def estadisticas() -> Dict:
+    with _lock:
+        return {
+            **_stats,
+            "abiertos": len(_abiertos),
+            "prestados": sum(e.refs for e in _abiertos.values()),
+            "max": MAX_ABIERTOS,
+        }
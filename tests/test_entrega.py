@@ -0,0 +1,144 @@
+# tests/test_entrega.py
+"""
+Entrega de páginas en caché y portadas con ENTREGA_MODO = flask / nginx /
+apache: cabecera de delegación, cuerpo vacío, ETag y Cache-Control de la
+vista y 304 en los tres modos.
+"""
+import os, shutil, uuid
+
+import pytest
+from flask import Flask
+
+import services.entrega_service as entrega_service
+import services.pagina_service as pagina_service
+
+CONTENIDO = b"\xff\xd8\xff\xe0 pagina de prueba \xff\xd9"
+PORTADAS  = os.path.join(entrega_service.STATIC_DIR, "uploads", "portadas")
+
+
+# ───── fixtures ──────────────────────────────────────────────────────────────
+@pytest.fixture(params=["flask", "nginx", "apache"])
+def modo(request, monkeypatch):
+    monkeypatch.setattr(entrega_service, "MODO", request.param)
+    return request.param
+
+
+@pytest.fixture
+def indice():
+    huella = uuid.uuid4().hex * 2
+    indice = {"huella": huella, "capitulos": {1: ["c1/001.png"]}, "paginas": {}}
+    dst = pagina_service._ruta(indice, 1, "001.png", None, "jpeg")
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    with open(dst, "wb") as fh:
+        fh.write(CONTENIDO)
+    yield indice
+    shutil.rmtree(os.path.dirname(os.path.dirname(dst)), ignore_errors=True)
+
+
+@pytest.fixture
+def portada():
+    os.makedirs(PORTADAS, exist_ok=True)
+    nombre = f"prueba-{uuid.uuid4().hex}.jpg"
+    with open(os.path.join(PORTADAS, nombre), "wb") as fh:
+        fh.write(CONTENIDO)
+    yield "uploads/portadas/" + nombre
+    os.remove(os.path.join(PORTADAS, nombre))
+
+
+@pytest.fixture
+def cliente(indice):
+    # Igual que main.py: vista `static` envuelta y una ruta de página
+    app = Flask(__name__, static_folder=entrega_service.STATIC_DIR)
+    vista = app.view_functions["static"]
+    app.view_functions["static"] = lambda filename: entrega_service.servir_estatico(filename, vista)
+
+    @app.route("/pagina/<filename>")
+    def pagina(filename):
+        return pagina_service.servir("no-se-abre.zip", indice, 1, filename)
+
+    return app.test_client()
+
+
+def _delegacion(resp, modo):
+    return {
+        "flask":  None,
+        "nginx":  resp.headers.get("X-Accel-Redirect"),
+        "apache": resp.headers.get("X-Sendfile"),
+    }[modo]
+
+
+# ───── páginas de la caché ───────────────────────────────────────────────────
+def test_pagina(cliente, indice, modo):
+    resp = cliente.get("/pagina/001.png", headers={"Accept": "image/jpeg"})
+    dst = pagina_service._ruta(indice, 1, "001.png", None, "jpeg")
+    assert resp.status_code == 200
+    assert resp.headers["Content-Type"] == "image/jpeg"
+    assert resp.get_etag()[0] == pagina_service._hash_archivo(dst)
+    assert resp.cache_control.public and resp.cache_control.max_age == pagina_service.MAX_AGE
+    assert "Accept" in resp.vary
+
+    if modo == "flask":
+        assert resp.data == CONTENIDO
+        assert "X-Accel-Redirect" not in resp.headers and "X-Sendfile" not in resp.headers
+    else:
+        assert resp.data == b""
+        relativa = os.path.relpath(dst, entrega_service.STATIC_DIR).replace(os.sep, "/")
+        esperada = (entrega_service.PREFIJO + relativa if modo == "nginx"
+                    else os.path.realpath(dst))
+        assert _delegacion(resp, modo) == esperada
+
+
+def test_pagina_304(cliente, modo):
+    etag = cliente.get("/pagina/001.png").get_etag()[0]
+    resp = cliente.get("/pagina/001.png", headers={"If-None-Match": f'"{etag}"'})
+    assert resp.status_code == 304
+    assert resp.data == b""
+    assert resp.get_etag()[0] == etag
+    assert resp.cache_control.max_age == pagina_service.MAX_AGE
+    assert "X-Accel-Redirect" not in resp.headers and "X-Sendfile" not in resp.headers
+
+
+def test_pagina_versionada_inmutable(cliente, indice, modo):
+    resp = cliente.get(f"/pagina/001.png?v={indice['huella'][:16]}")
+    assert resp.status_code == 200 and resp.cache_control.immutable
+
+
+# ───── portadas (vista static) ───────────────────────────────────────────────
+def test_portada(cliente, portada, modo, monkeypatch):
+    llamadas = []
+    original = entrega_service.enviar
+    monkeypatch.setattr(entrega_service, "enviar",
+                        lambda *a, **k: llamadas.append(a) or original(*a, **k))
+
+    resp = cliente.get("/static/" + portada)
+    assert resp.status_code == 200
+    assert resp.last_modified is not None
+    if modo == "flask":
+        assert resp.data == CONTENIDO and not llamadas
+    else:
+        ruta = os.path.join(entrega_service.STATIC_DIR, portada)
+        assert llamadas == [(ruta,)]
+        assert resp.data == b""
+        assert resp.headers["Content-Type"] == "image/jpeg"
+        monkeypatch.setattr(entrega_service, "MODO", "flask")
+        directa = cliente.get("/static/" + portada)
+        assert resp.headers["Cache-Control"] == directa.headers["Cache-Control"]
+        esperada = (entrega_service.PREFIJO + portada if modo == "nginx"
+                    else os.path.realpath(ruta))
+        assert _delegacion(resp, modo) == esperada
+
+    monkeypatch.setattr(entrega_service, "MODO", modo)
+    resp = cliente.get("/static/" + portada,
+                       headers={"If-Modified-Since": resp.headers["Last-Modified"]})
+    assert resp.status_code == 304 and resp.data == b""
+    assert "X-Accel-Redirect" not in resp.headers and "X-Sendfile" not in resp.headers
+
+
+def test_portada_inexistente(cliente, modo):
+    assert cliente.get("/static/uploads/portadas/no-existe.jpg").status_code == 404
+
+
+def test_resto_de_static_no_se_delega(cliente, modo):
+    resp = cliente.get("/static/" + os.path.relpath(__file__, entrega_service.STATIC_DIR)
+                       .replace(os.sep, "/"))
+    assert "X-Accel-Redirect" not in resp.headers and "X-Sendfile" not in resp.headers